@@ -0,0 +1,283 @@
+import os
+import logging
+import json
+import numpy as np
+
+import fileloader
+import fitfunctions
+from line import Line
+from toolbase import ToolBase
+from sessionfilemanager import SessionFileManager
+from smoothingcore import smoothMethods
+from bgsubtractioncore import bgsubMethods
+from interpolationcore import interpMethods
+import iadcore
+import fitcore
+from fitobjective import FitProblem, optimizeLines
+
+
+
+__all__ = ['BatchSession', 'processSession']
+
+
+
+class BatchSession:
+  # A session file evaluated without QApplication or widgets: sources
+  # are loaded and their sheet formulas applied as MainWindow does, and
+  # the IAD and fit tools are computed from their saved states through
+  # iadcore/fitcore.
+  funcClasses = [getattr(fitfunctions, name) for name in fitfunctions.__all__]
+
+  def __init__(self, filename):
+    self.filename = os.path.realpath(filename)
+    self.session = SessionFileManager().load(self.filename)
+    if self.session is None:
+      raise RuntimeError('Session file not found: %s' % filename)
+    self.lines = self.loadLines()
+
+  def loadLines(self):
+    from os.path import normpath, join, dirname
+
+    lines, names = [], {}
+    for f in self.session.get('files', []):
+      if not f.get('enabled', True):
+        continue
+
+      filename = normpath(join(dirname(self.filename), f['filename']))
+      book = fileloader.load(filename)
+      for s in f['sheets']:
+        if not s['enabled']:
+          continue
+
+        sheet = book.getSheet(s['index'])
+        if 'xformula' in s: sheet.xFormula.setStrValue(s['xformula'])
+        if 'yformula' in s: sheet.yFormula.setStrValue(s['yformula'])
+        if 'xrange' in s: sheet.xRange.setStrValue(s['xrange'])
+        if s.get('errors'): sheet.setErrors(s['errors'])
+
+        X = sheet.xValues()
+        Y = sheet.yValues()
+        Y_ = sheet.yErrors()
+        if len(X) == 1: X = list(X) * len(Y)
+        if len(X) != len(Y): raise RuntimeError('X and Y formulae count mismatch')
+
+        for i, (x, y, y_) in enumerate(zip(X, Y, Y_)):
+          name = sheet.name
+          if len(Y) > 1: name += ':%s' % i
+          name = ToolBase.uniqueName(name, names)
+          x, y, y_ = Line.cleanUp(x, y, y_)
+          names[name] = Line(name, x, y, y_)
+          lines.append(names[name])
+
+    logging.info('%s: %d lines' % (self.filename, len(lines)))
+    return lines
+
+  def widgetState(self, toolName):
+    return self.session.get('tools', {}).get(toolName, {})
+
+  @classmethod
+  def settings(cls, state, defaults):
+    values = dict(defaults)
+    for p in state.get('items', []):
+      values[p['name']] = str(p['value'])
+    return values
+
+  @classmethod
+  def methodObject(cls, state, selector, classes):
+    name = state.get('curr_%s' % selector)
+    for c in classes:
+      if c.name == name:
+        break
+    else:
+      c = classes[0]
+    return c(cls.settings(state.get(c.name, {}), c.settingDefaults))
+
+  def iad(self):
+    if not self.lines:
+      return []
+
+    state = self.widgetState('iad')
+    tool = state.get('tool', {})
+    settings = self.settings(tool, iadcore.settingDefaults)
+    dx, threshold = float(settings['interpdx']), float(settings['threshold'])
+    base = tool.get('base', -1)
+    if not -len(self.lines) <= base < len(self.lines):
+      base = -1
+
+    lines, linesF, linesX = iadcore.prepareLines(
+      self.lines,
+      self.methodObject(state, 'smooth', smoothMethods),
+      self.methodObject(state, 'interp', interpMethods),
+      self.methodObject(state, 'bgsub', bgsubMethods), dx)
+    lines_off, xoff = iadcore.offsetLines(lines, linesF, base, dx, threshold)
+    diff, iadY = iadcore.iadValues(lines_off, base)
+    iadY_ = iadcore.iadErrors(self.lines, base)
+
+    results = []
+    for line, l, o, y, y_ in zip(self.lines, lines_off, xoff, iadY, iadY_):
+      px, py = l.peak()
+      results.append({
+        'name': line.name,
+        'iad_x': iadcore.iadXFromName(line.name),
+        'iad_y': float(y),
+        'iad_err': float(y_),
+        'xoff': float(o),
+        'weight_center': float(l.weightCenter()),
+        'peak_x': float(px),
+        'peak_y': float(py),
+        'base': line is self.lines[base]
+      })
+    return results
+
+  def functionClass(self, name):
+    for cls in self.funcClasses:
+      if cls.name == name:
+        return cls
+    raise RuntimeError('Function named "%s" is not defined' % name)
+
+  def fit(self, method='Nelder-Mead', params=None, executor=None):
+    # params: variables in "F1_name" format; all parameters of the
+    # functions' expressions by default
+    state = self.widgetState('fit')
+    tool = state.get('tool', {})
+    functions = [(self.functionClass(name), id) for name, id in tool.get('peak_functions', [])]
+    if not functions or not self.lines:
+      return []
+
+    # parameters of functions that are not stored for a line are taken
+    # from the first line having them
+    stored = tool.get('peak_func_params', {})
+    defaults = {}
+    for line in self.lines:
+      for id, values in stored.get(line.name, {}).items():
+        defaults.setdefault(id, values)
+    for cls, id in functions:
+      if id not in defaults:
+        raise RuntimeError('No parameters are stored for %s (%s)' % (cls.label, id))
+
+    settings = self.settings(tool, fitcore.settingDefaults)
+    constraints = fitcore.parseConstraints(settings['constraints'], [
+      (cls.label, set(cls.exprArgs()) | set(defaults[id])) for cls, id in functions])
+    constraints = [(FitProblem.symbolName(i, pn), rhs) for i, pn, rhs in constraints]
+
+    if params is None:
+      params = [FitProblem.symbolName(i, n)
+                for i, (cls, id) in enumerate(functions) for n in cls.exprArgs()]
+    params = [p for p in params if p not in [lhs for lhs, rhs in constraints]]
+
+    window = None
+    normWindow = [(self.functionClass(name), values) for name, values in tool.get('norm_window', [])]
+    if normWindow:
+      window = lambda x: np.sum([cls.evaluate(x, values) for cls, values in normWindow], axis=0)
+    values = fitcore.normalizeLines(
+      self.lines,
+      self.methodObject(state, 'bgsub', bgsubMethods),
+      self.methodObject(state, 'smooth', smoothMethods), window)
+
+    fitRange = tuple(map(float, settings['fitRange'].split(':', 1)))
+    jobs = []
+    for line, (y, y2) in zip(self.lines, values):
+      funcParams = stored.get(line.name, {})
+      problem = fitcore.createProblem(
+        [cls.expr for cls, id in functions],
+        [funcParams.get(id, defaults[id]) for cls, id in functions],
+        params, constraints, line.x, y2, fitRange)
+      jobs.append([line.name, problem, line.name in stored])
+
+    logging.info('%s: fit %d lines (%s) using %s' % (
+      self.filename, len(jobs), ','.join(params), method))
+
+    problems = {name: problem for name, problem, seeded in jobs}
+    results = {}
+    def progress(name, res):
+      if isinstance(res, Exception):
+        logging.error('Optimize failed: %s (%s)' % (name, res))
+        results[name] = {'name': name, 'success': False, 'message': str(res)}
+        return
+      values = dict(zip(params, map(float, res.x)))
+      values.update(zip([lhs for lhs, rhs in constraints], res.constraintValues))
+      y = problems[name].y
+      results[name] = {
+        'name': name,
+        'success': bool(res.success),
+        'message': res.message,
+        'residual': float(res.fun),
+        'R2': float(1 - res.fun/np.sum((y - np.mean(y))**2)),
+        'nfev': int(res.nfev),
+        'params': values
+      }
+
+    optimizeLines(jobs, method, executor=executor, progress=progress)
+    return [results[line.name] for line in self.lines if line.name in results]
+
+
+
+def writeCSV(filename, rows, columns):
+  import csv
+  with open(filename, 'w', newline='') as f:
+    w = csv.writer(f)
+    w.writerow(columns)
+    for row in rows:
+      w.writerow([row.get(c, '') for c in columns])
+
+
+def writeXlsx(filename, tables):
+  import xlsxwriter
+  wb = xlsxwriter.Workbook(filename)
+  try:
+    for name, rows, columns in tables:
+      ws = wb.add_worksheet(name)
+      for c, col in enumerate(columns):
+        ws.write(0, c, col)
+      for r, row in enumerate(rows):
+        for c, col in enumerate(columns):
+          v = row.get(col)
+          if v is not None:
+            ws.write(r + 1, c, v)
+  finally:
+    wb.close()
+
+
+def processSession(filename, outdir, formats=('json',), iad=True, fit=True,
+                   method='Nelder-Mead', params=None):
+  # Evaluates one session file and writes <outdir>/<session name>.<format>;
+  # returns the names of the written files.
+  session = BatchSession(filename)
+  results = {'session': session.filename}
+  if iad:
+    results['iad'] = session.iad()
+  if fit:
+    results['fit'] = session.fit(method, params)
+
+  iadColumns = ['name', 'iad_x', 'iad_y', 'iad_err', 'xoff',
+                'weight_center', 'peak_x', 'peak_y', 'base']
+  fitRows = []
+  fitColumns = ['name', 'success', 'R2', 'residual', 'nfev', 'message']
+  for res in results.get('fit', []):
+    row = dict(res)
+    row.update(res.get('params', {}))
+    fitRows.append(row)
+    fitColumns += [n for n in res.get('params', {}) if n not in fitColumns]
+  tables = [t for t in [('IAD', results.get('iad', []), iadColumns),
+                        ('Fit', fitRows, fitColumns)] if t[1]]
+
+  if not os.path.exists(outdir):
+    os.makedirs(outdir)
+  base = os.path.join(outdir, os.path.splitext(os.path.basename(filename))[0])
+  written = []
+  for fmt in formats:
+    if fmt == 'json':
+      with open(base + '.json', 'w') as f:
+        json.dump(results, f, indent=2)
+      written.append(base + '.json')
+    elif fmt == 'csv':
+      for name, rows, columns in tables:
+        fn = '%s_%s.csv' % (base, name.lower())
+        writeCSV(fn, rows, columns)
+        written.append(fn)
+    elif fmt == 'xlsx':
+      writeXlsx(base + '.xlsx', tables)
+      written.append(base + '.xlsx')
+    else:
+      raise RuntimeError('Unknown output format: %s' % fmt)
+  return written
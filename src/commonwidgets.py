@@ -5,7 +5,7 @@ import html
 from PyQt5.QtCore import Qt, pyqtSignal, QObject, QPoint, QRect, QSize, QEvent, QCoreApplication
 from PyQt5.QtGui import QKeySequence, QValidator, QPainter, \
   QPen, QBrush, QColor, QPixmap, QMouseEvent
-from PyQt5.QtWidgets import QApplication, QWidget, QTableWidget, QMenu, \
+from PyQt5.QtWidgets import QApplication, QWidget, QTableWidget, QTableView, QMenu, \
   QFrame, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QLineEdit, QLayout, \
   QComboBox, QGridLayout, QPushButton
 import numpy as np
@@ -15,7 +15,7 @@ import log
 
 
 __all__ = [
-  'TableWidget', 'HSeparator', 'HBoxLayout', 'VBoxLayout',
+  'TableWidget', 'TableView', 'HSeparator', 'HBoxLayout', 'VBoxLayout',
   'ErrorBaloon', 'ErrorCheckEdit', 'FlowLayout',
   'DescriptionWidget', 'ComboBoxWithDescriptor',
   'ExpanderWidget'
@@ -23,9 +23,9 @@ __all__ = [
 
 
 
-class TableWidget(QTableWidget):
-  def __init__(self):
-    super().__init__()
+class TableBase:
+  # context menu and key bindings shared by the tables
+  def initActions(self):
     self.menu = QMenu()
     self.keys = []
 
@@ -52,6 +52,13 @@ class TableWidget(QTableWidget):
   def contextMenuEvent(self, ev):
     self.menu.exec_(ev.globalPos())
 
+
+
+class TableWidget(TableBase, QTableWidget):
+  def __init__(self):
+    super().__init__()
+    self.initActions()
+
   def getSelectedItemTable(self):
     col, row, val = [], [], []
     for index in self.selectedIndexes():
@@ -114,6 +121,63 @@ class TableWidget(QTableWidget):
 
 
 
+class TableView(TableBase, QTableView):
+  # TableWidget for a model; only the visible cells are read from it
+  def __init__(self, model=None):
+    super().__init__()
+    self.initActions()
+    if model is not None:
+      self.setModel(model)
+
+  def getSelectedIndexTable(self):
+    indexes = self.selectedIndexes()
+    if not indexes:
+      return []
+
+    col = np.array([self.horizontalHeader().visualIndex(i.column()) for i in indexes])
+    row = np.array([self.verticalHeader().visualIndex(i.row()) for i in indexes])
+    col -= col.min()
+    row -= row.min()
+
+    data = dict(zip(zip(row, col), indexes))
+    return [[data.get((r, c)) for c in range(col.max()+1)] for r in range(row.max()+1)]
+
+  def copySelected(self):
+    tbl = self.getSelectedIndexTable()
+    QApplication.clipboard().setText('\n'.join([
+      '\t'.join([str(i.data()).strip() if i else '' for i in r]) for r in tbl]))
+
+  def paste(self):
+    text = QApplication.clipboard().text()
+    data = [[c.strip() for c in l.split('\t')] for l in re.split(r'\r?\n', text)]
+
+    sel = self.getSelectedIndexTable()
+    model = self.model()
+
+    if len(sel) == 0:
+      return
+    elif len(sel) == 1 and len(sel[0]) == 1:
+      r0, c0 = sel[0][0].row(), sel[0][0].column()
+      for r, vals in enumerate(data):
+        for c, text in enumerate(vals):
+          index = model.index(r0+r, c0+c)
+          if index.isValid() and model.flags(index) & Qt.ItemIsEditable:
+            model.setData(index, text)
+      return
+
+
+    selerr_msg = 'The shapes of table selection and paste data are different'
+    if len(sel) != len(data) or any(len(i) != len(v) for i, v in zip(sel, data)):
+      logging.error(selerr_msg)
+      return
+
+    for indexes, values in zip(sel, data):
+      for index, val in zip(indexes, values):
+        if index and model.flags(index) & Qt.ItemIsEditable:
+          model.setData(index, val)
+
+
+
 class HSeparator(QFrame):
   def __init__(self):
     super().__init__()
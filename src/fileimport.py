@@ -0,0 +1,63 @@
+import logging
+from PyQt5.QtCore import QThread, pyqtSignal
+
+import fileloader
+from parsecache import ParseCache
+
+
+
+__all__ = ['ImportThread']
+
+
+
+class ImportThread(QThread):
+  # Parses files into the parse cache concurrently; in threads, or in
+  # processes for the loaders of FileLoaderBase.inProcess (pyexcel).
+  # loaded is emitted with the filename and None or the exception as soon
+  # as the file and the files before it are done, as the order of the
+  # files is the order of the lines.
+  loaded = pyqtSignal(str, object)
+
+  def __init__(self, filenames, maxWorkers=None):
+    super().__init__()
+    self.filenames = list(filenames)
+    self.maxWorkers = maxWorkers
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+  def run(self):
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    from fitobjective import processPool
+
+    inProcess = [fn for fn in self.filenames
+                 if getattr(fileloader.loaderClass(fn), 'inProcess', True)]
+    inThread = [fn for fn in self.filenames if fn not in inProcess]
+    threads = ThreadPoolExecutor(self.maxWorkers)
+    processes = processPool(self.maxWorkers) if inProcess else None
+    try:
+      futures = {}
+      for pool, filenames in (threads, inThread), (processes, inProcess):
+        for fn in filenames:
+          futures[fn] = pool.submit(fileloader.prepare, fn)
+
+      queue = list(self.filenames)
+      pending = set(futures.values())
+      while queue and not self.cancelled:
+        done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+        while queue and futures[queue[0]].done():
+          fn = queue.pop(0)
+          ex = futures[fn].exception()
+          if ex is None and futures[fn].result():
+            # the file is not hashed again for loading it from the cache
+            ParseCache.get().addFileHash(*futures[fn].result())
+          self.loaded.emit(fn, ex)
+
+      if queue:
+        logging.info('Import cancelled: %d files' % len(queue))
+    finally:
+      # files being parsed when cancelled are left to finish in the cache
+      for pool in threads, processes:
+        if pool:
+          pool.shutdown(wait=not self.cancelled, cancel_futures=True)
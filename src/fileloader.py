@@ -1,8 +1,13 @@
 import os
 import re
+import io
+import struct
+import zipfile
 import logging
+import numpy as np
 
-from sheetbase import SheetBase
+from sheetbase import SheetBase, UnsupportedFileException
+from parsecache import ParseCache
 
 
 
@@ -37,6 +42,15 @@ class FileLoaderBase:
   def getSheet(self, idx):
     raise NotImplementedError()
 
+  def close(self):
+    # releases the open source file, if any
+    pass
+
+
+  # cacheable: parsed sheets are kept in ParseCache
+  # inProcess: imported in a worker process rather than a thread
+  cacheable = True
+  inProcess = False
 
   @classmethod
   def canLoad(cls, mimetype):
@@ -45,6 +59,13 @@ class FileLoaderBase:
       return re.search(pat, mimetype)
     raise NotImplementedError()
 
+  @classmethod
+  def canLoadFile(cls, filename, mimetype):
+    ext = getattr(cls, 're_ext', None)
+    if ext and re.search(ext, filename, re.I):
+      return True
+    return cls.canLoad(mimetype)
+
 
 class FileLoaderText(FileLoaderBase):
   re_pat = '^text/plain'
@@ -52,29 +73,115 @@ class FileLoaderText(FileLoaderBase):
 
 
   class Sheet(SheetBase):
-    def __init__(self, filename, delimiter):
-      text = open(filename).read()
-
-      self.rows = []
-      for l in text.split('\n'):
-        if l.startswith('#@ '): l = l[3:]
-        l = l.strip()
-        if l == '' or l.startswith('#'): continue
-        self.rows.append(list(map(str.strip, re.split(delimiter, l))))
-
-      self.ncols = max(map(len, self.rows))
+    # Numeric cells are parsed chunk by chunk straight into the columns
+    # array; only rows having non-numeric cells keep their strings.
+    chunkSize = 1 << 24
 
+    def __init__(self, filename, delimiter):
+      self.delimiter = delimiter
       super().__init__(filename, 0, os.path.basename(filename))
 
+    def createColumns(self):
+      blocks, self.textRows, nrows = [], {}, 0
+      for text in self.readChunks(self.filename):
+        for block in self.parseText(self.cleanText(text), nrows):
+          blocks.append(block)
+          nrows += len(block[0])
+
+      ncols = max([v.shape[1] for v, l in blocks] + [0])
+      columns = np.full((ncols, nrows), np.nan)
+      self.rowLength = np.empty(nrows, dtype=np.int32)
+      r = 0
+      for values, length in blocks:
+        columns[:values.shape[1],r:r+len(values)] = values.T
+        self.rowLength[r:r+len(values)] = length
+        r += len(values)
+      return columns
+
+    @classmethod
+    def readChunks(cls, filename):
+      # yields the text of the file in chunks of about chunkSize bytes,
+      # split at line ends
+      import mmap, locale
+      encoding = locale.getpreferredencoding(False)
+      with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+          return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+          pos = 0
+          while pos < len(m):
+            end = m.find(b'\n', pos + cls.chunkSize)
+            end = len(m) if end < 0 else end + 1
+            yield m[pos:end].decode(encoding)
+            pos = end
+
+    @classmethod
+    def cleanText(cls, text):
+      # "#@ " at the beginning of a line is removed, other lines starting
+      # with "#" are comments
+      if '#' in text:
+        text = re.sub(r'(?m)^#@ ', '', text)
+        text = re.sub(r'(?m)^[^\S\n]*#.*$', '', text)
+      return text
+
+    def parseText(self, text, r0):
+      if not text.strip():
+        return
+      delimiter = None if self.delimiter == r'\s+' else self.delimiter
+      try:
+        values = np.loadtxt(io.StringIO(text), delimiter=delimiter, comments=None, ndmin=2)
+      except ValueError:
+        lines = [l for l in map(str.strip, text.splitlines()) if l]
+        yield from self.parseLines(lines, r0)
+      else:
+        if values.size:
+          yield values, values.shape[1]
+
+    def parseLines(self, lines, r0):
+      # yields blocks of (values, row length); a block failing to parse as
+      # a numeric table is bisected to find the rows having text cells
+      if len(lines) > 64:
+        delimiter = None if self.delimiter == r'\s+' else self.delimiter
+        try:
+          values = np.loadtxt(lines, delimiter=delimiter, comments=None, ndmin=2)
+        except ValueError:
+          mid = len(lines)//2
+          yield from self.parseLines(lines[:mid], r0)
+          yield from self.parseLines(lines[mid:], r0 + mid)
+        else:
+          yield values, values.shape[1]
+        return
+
+      rows = [list(map(str.strip, re.split(self.delimiter, l))) for l in lines]
+      if not rows:
+        return
+      ncols = max(map(len, rows))
+      values = np.full((len(rows), ncols), np.nan)
+      for i, row in enumerate(rows):
+        for c, v in enumerate(row):
+          try:
+            values[i,c] = float(v)
+          except ValueError:
+            self.textRows[r0 + i] = row
+      yield values, np.array(list(map(len, rows)))
+
+    def free(self):
+      super().free()
+      self.textRows = self.rowLength = None
+
     def colCount(self):
-      return self.ncols
+      return self.getColumns().shape[0]
 
     def rowCount(self):
-      return len(self.rows)
+      return self.getColumns().shape[1]
 
     def getValue(self, r, c):
-      r = self.rows[r]
-      return r[c] if c < len(r) else ''
+      columns = self.getColumns()
+      if c >= self.rowLength[r]:
+        return ''
+      if r in self.textRows:
+        return self.textRows[r][c]
+      return float(columns[c,r])
 
 
   def __init__(self, filename):
@@ -93,61 +200,398 @@ class FileLoaderCSV(FileLoaderText):
   delimiter = r','
 
 
+class FileLoaderArray(FileLoaderBase):
+  # Binary arrays; each array is a sheet.  The arrays are memory mapped
+  # where the format allows, so they are not cached nor copied.
+  cacheable = False
+
+
+  class Sheet(SheetBase):
+    # columns of a 1-D, 2-D (row, column) or structured array; they are
+    # views of the array if it is of float64
+    def __init__(self, filename, idx, name, array):
+      self.array = array
+      super().__init__(filename, idx, name)
+
+    def createColumns(self):
+      array = self.array
+      if array.dtype.names:
+        from numpy.lib import recfunctions
+        array = recfunctions.structured_to_unstructured(array, copy=False)
+      if array.ndim == 1:
+        array = array[:,None]
+      elif array.ndim > 2:
+        array = array.reshape(len(array), -1)
+      return array.T.astype(float, copy=False)
+
+    def colCount(self):
+      return self.getColumns().shape[0]
+
+    def rowCount(self):
+      return self.getColumns().shape[1]
+
+    def getValue(self, r, c):
+      return float(self.getColumns()[c,r])
+
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.sheets = []
+    for name, array in self.arrays(filename):
+      if array.ndim == 0 or array.size == 0:
+        logging.info('Skip empty array: %s' % name)
+        continue
+      if not (array.dtype.names or array.dtype.kind in 'biuf'):
+        logging.info('Skip non-numeric array: %s %s' % (name, array.dtype))
+        continue
+      self.sheets.append(self.Sheet(filename, len(self.sheets), name, array))
+
+  def arrays(self, filename):
+    # yields (name, array)
+    raise NotImplementedError()
+
+  def sheetCount(self):
+    return len(self.sheets)
+
+  def getSheet(self, idx):
+    return self.sheets[idx]
+
+
+
+class FileLoaderNumpy(FileLoaderArray):
+  re_ext = r'\.np[yz]\Z'
+
+  @classmethod
+  def canLoad(cls, mimetype):
+    return False
+
+  def arrays(self, filename):
+    if not zipfile.is_zipfile(filename):
+      yield os.path.basename(filename), np.load(filename, mmap_mode='r')
+      return
+
+    with zipfile.ZipFile(filename) as zf:
+      for info in zf.infolist():
+        if not info.filename.endswith('.npy'):
+          continue
+        array = None
+        if info.compress_type == zipfile.ZIP_STORED:
+          array = self.mapMember(filename, info)
+        if array is None:
+          with zf.open(info) as f:
+            array = np.lib.format.read_array(f, allow_pickle=False)
+        yield info.filename[:-4], array
+
+  @classmethod
+  def mapMember(cls, filename, info):
+    # memory maps an uncompressed .npy in a .npz; None if it cannot be
+    readers = {
+      (1, 0): np.lib.format.read_array_header_1_0,
+      (2, 0): np.lib.format.read_array_header_2_0
+    }
+    with open(filename, 'rb') as f:
+      f.seek(info.header_offset)
+      header = f.read(30)
+      namelen, extralen = struct.unpack('<HH', header[26:30])
+      f.seek(info.header_offset + 30 + namelen + extralen)
+      version = np.lib.format.read_magic(f)
+      if version not in readers:
+        return None
+      shape, fortran, dtype = readers[version](f)
+      offset = f.tell()
+
+    if dtype.hasobject:
+      return None
+    if 0 in shape:
+      return np.empty(shape, dtype)
+    return np.memmap(filename, dtype, 'r', offset, shape, 'F' if fortran else 'C')
+
+
+
+class FileLoaderHDF5(FileLoaderArray):
+  re_pat = r'^application/x-hdf'
+  re_ext = r'\.(?:h5|hdf5?)\Z'
+
+  @classmethod
+  def canLoadFile(cls, filename, mimetype):
+    try:
+      import h5py
+    except ImportError:
+      return False
+    return super().canLoadFile(filename, mimetype)
+
+  def arrays(self, filename):
+    import h5py
+    datasets = []
+    with h5py.File(filename, 'r') as f:
+      f.visititems(lambda name, obj:
+        datasets.append((name, obj)) if isinstance(obj, h5py.Dataset) else None)
+      for name, ds in datasets:
+        yield name, self.mapDataset(filename, ds)
+
+  @classmethod
+  def mapDataset(cls, filename, ds):
+    # contiguous datasets are memory mapped, the others are read
+    offset = ds.id.get_offset()
+    if ds.chunks is None and offset is not None and not ds.dtype.hasobject and ds.size:
+      return np.memmap(filename, ds.dtype, 'r', offset, ds.shape)
+    return ds[()]
+
+
+
 class FileLoaderExcel(FileLoaderBase):
   re_pat = r'^application/vnd\.(?:openxmlformats-officedocument\.|ms-excel\.|oasis\.opendocument\.spreadsheet)'
+  inProcess = True
 
 
   class Sheet(SheetBase):
-    def __init__(self, filename, idx, sheet):
-      self.sheet = sheet
-      super().__init__(filename, idx, sheet.name)
+    # rows are read from the book only when the cell data is needed
+    def __init__(self, filename, idx, name, book):
+      self.book = book
+      self.cells = None
+      super().__init__(filename, idx, name)
+
+    def createColumns(self):
+      rows = self.book.sheetRows(self.name)
+      ncols = max(map(len, rows), default=0)
+      rows = [list(row) + [''] * (ncols - len(row)) for row in rows]
+      columns = self.toColumns(rows, ncols)
+
+      self.cells = {}
+      for r in np.unique(np.nonzero(np.isnan(columns))[1]):
+        for c, v in enumerate(rows[r]):
+          if not isinstance(v, (int, float)):
+            self.cells[(int(r), c)] = str(v)
+      return columns
+
+    def free(self):
+      super().free()
+      self.cells = None
 
     def colCount(self):
-      return self.sheet.number_of_columns()
+      return self.getColumns().shape[0]
 
     def rowCount(self):
-      return self.sheet.number_of_rows()
+      return self.getColumns().shape[1]
+
+    def getValue(self, r, c):
+      columns = self.getColumns()
+      if (r, c) in self.cells:
+        return self.cells[(r, c)]
+      return float(columns[c,r])
 
-    def getValue(self, y, x):
-      return self.sheet.cell_value(y, x)
 
+  # Sheets are streamed from a book opened on demand; openpyxl is used in
+  # read-only mode, so hidden rows and columns of xlsx are not skipped.
+  # The book is closed when all the sheets are read or by close(), which
+  # must run in the thread that opened it (free_resources is per thread).
+  options = {'skip_hidden_row_and_column': False}
 
   def __init__(self, filename):
     import pyexcel
     logging.info('Trying to load by pyexcel: %s' % filename)
     self.filename = filename
-    self.book = pyexcel.get_book(file_name=filename)
+    self.stream = pyexcel.iget_book(file_name=filename, **self.options)
+    self.names = list(self.stream.sheet_names())
+    self.rows = self.stream.to_dict()
+
+  def sheetRows(self, name):
+    # each sheet can be read once from the stream; later reads reopen it
+    rows = self.rows.pop(name, None)
+    if rows is None:
+      import pyexcel
+      return pyexcel.get_array(file_name=self.filename, sheet_name=name, **self.options)
+    try:
+      return list(rows)
+    finally:
+      if not self.rows:
+        self.close()
+
+  def close(self):
+    if self.stream is not None:
+      import pyexcel
+      self.stream, self.rows = None, {}
+      pyexcel.free_resources()
 
   def sheetCount(self):
-    return self.book.number_of_sheets()
+    return len(self.names)
 
   def getSheet(self, idx):
-    return self.Sheet(self.filename, idx, self.book[idx])
+    return self.Sheet(self.filename, idx, self.names[idx], self)
 
   @classmethod
   def canLoad(cls, mimetype):
     return True
 
 
-def load(filename):
+class FileLoaderCached(FileLoaderBase):
+  # Sheets backed by ParseCache.  The names of the sheets are cached when
+  # the file is loaded, the cell data of each sheet when it is first
+  # needed; the source is parsed only for sheets missing from the cache.
+
+  class Sheet(SheetBase):
+    def __init__(self, filename, idx, name, book):
+      self.book = book
+      self.cells = None
+      super().__init__(filename, idx, name)
+
+    def createColumns(self):
+      data = self.book.cache.load(self.book.fileHash, 'sheet%d' % self.idx)
+      if data is None:
+        try:
+          data = self.book.parseSheet(self.idx)
+        finally:
+          self.book.closeSource()
+
+      meta, arrays = data
+      self.cells = {(r, c): v for r, c, v in meta['cells']}
+      return arrays['columns']
+
+    def free(self):
+      super().free()
+      self.cells = None
+
+    def colCount(self):
+      return self.getColumns().shape[0]
+
+    def rowCount(self):
+      return self.getColumns().shape[1]
+
+    def getValue(self, r, c):
+      columns = self.getColumns()
+      if (r, c) in self.cells:
+        return self.cells[(r, c)]
+      return float(columns[c,r])
+
+
+  def __init__(self, filename, cache, fileHash, names, source=None):
+    self.filename = filename
+    self.cache = cache
+    self.fileHash = fileHash
+    self.source = source
+    self.sheets = [self.Sheet(filename, i, name, self) for i, name in enumerate(names)]
+
+  @classmethod
+  def restore(cls, filename, cache, fileHash):
+    data = cache.load(fileHash, 'book')
+    if data is None:
+      return None
+    return cls(filename, cache, fileHash, data[0]['sheets'])
+
+  @classmethod
+  def create(cls, filename, cache, fileHash, source):
+    names = [source.getSheet(i).name for i in range(source.sheetCount())]
+    cache.save(fileHash, 'book', {'sheets': names}, {})
+    return cls(filename, cache, fileHash, names, source)
+
+  def prepare(self):
+    # parses the sheets missing from the cache
+    try:
+      for sheet in self.sheets:
+        if not self.cache.contains(self.fileHash, 'sheet%d' % sheet.idx):
+          self.parseSheet(sheet.idx)
+    finally:
+      self.closeSource()
+
+  def parseSheet(self, idx):
+    # (meta, arrays) of a sheet parsed from the source; it is saved to the
+    # cache unless it has non-numeric cells other than strings, which the
+    # cache does not store
+    sheet = self.sourceSheet(idx)
+    data = self.cacheData(sheet)
+    sheet.free()
+    if all(isinstance(v, str) for r, c, v in data[0]['cells']):
+      self.cache.save(self.fileHash, 'sheet%d' % idx, *data)
+    else:
+      logging.debug('Not cached: %s sheet%d' % (self.filename, idx))
+    return data
+
+  def sourceSheet(self, idx):
+    if self.source is None:
+      self.source = load(self.filename, False)
+    return self.source.getSheet(idx)
+
+  def closeSource(self):
+    # the parsed source is dropped once its sheets are in the cache
+    if self.source is not None:
+      self.source.close()
+      self.source = None
+
+  def sheetCount(self):
+    return len(self.sheets)
+
+  def getSheet(self, idx):
+    return self.sheets[idx]
+
+  @classmethod
+  def cacheData(cls, sheet):
+    # (meta, arrays) of a sheet for ParseCache; the values of the rows
+    # having non-numeric cells are kept in meta
+    columns = sheet.getColumns()
+    cells = []
+    for r in np.unique(np.nonzero(np.isnan(columns))[1]):
+      for c in range(sheet.colCount()):
+        v = sheet.getValue(int(r), c)
+        if not isinstance(v, (int, float, np.number)):
+          cells.append((int(r), c, v))
+    return {'cells': cells}, {'columns': columns}
+
+
+def mimeType(filename):
   from PyQt5.QtCore import QMimeDatabase
+  return QMimeDatabase().mimeTypeForFile(filename).name()
+
+
+loaders = [FileLoaderText, FileLoaderCSV, FileLoaderNumpy, FileLoaderHDF5, FileLoaderExcel]
+
+
+def loaderClass(filename):
+  t = mimeType(filename)
+  for o in loaders:
+    if o.canLoadFile(filename, t):
+      return o
+  return None
+
+
+def prepare(filename):
+  # loads a file into the parse cache; run by the import workers.  Returns
+  # the fileHash of the cache, or None, for ParseCache.addFileHash of the
+  # process loading the file afterwards.
+  book = load(filename)
+  if isinstance(book, FileLoaderCached):
+    book.prepare()
+    return book.fileHash
+  return None
+
+
+def load(filename, cache=True):
   try:
     from pyexcel.exceptions import FileTypeNotSupported
   except ModuleNotFoundError:
     from pyexcel.sources.factory import FileTypeNotSupported
-  loaders = [FileLoaderText, FileLoaderCSV, FileLoaderExcel]
 
   if not os.path.exists(filename) and '\\' in filename:
     newfn = filename.replace('\\', '/')
     if os.path.exists(newfn):
       filename = newfn
 
-  t = QMimeDatabase().mimeTypeForFile(filename).name()
+  parseCache = ParseCache.get() if cache else None
+  t = mimeType(filename)
   for o in loaders:
-    if o.canLoad(t):
+    if o.canLoadFile(filename, t):
+      if parseCache and o.cacheable:
+        fileHash = parseCache.fileHash(filename)
+        book = FileLoaderCached.restore(filename, parseCache, fileHash)
+        if book is not None:
+          return book
+
       try:
-        return o(filename)
+        book = o(filename)
       except FileTypeNotSupported:
-        pass
+        continue
+
+      if parseCache and o.cacheable:
+        return FileLoaderCached.create(filename, parseCache, fileHash, book)
+      return book
 
   raise UnsupportedFileException(filename, t)
@@ -0,0 +1,109 @@
+import re
+import numpy as np
+
+from fitobjective import FitProblem
+
+
+
+__all__ = ['settingDefaults', 'InvalidConstraints', 'parseConstraints', 'normalizeXY',
+           'normalizeLines', 'createProblem']
+
+
+
+# Parts of the fit tool that do not need Qt objects; FitTool and the
+# batch processor both go through these functions.
+
+
+settingDefaults = {
+  'fitRange': '-inf:inf',
+  'constraints': ''
+}
+
+
+
+class InvalidConstraints(Exception):
+  def __init__(self, msg):
+    super().__init__()
+    self.reason = msg
+
+
+
+def parseConstraints(constraints, functions):
+  # functions: [(label, parameter names)] in the order of F1, F2, ...
+  # returns [(function index, parameter name, rhs text)]
+  from sympy import Symbol, sympify
+  exprs = constraints.strip()
+  if not exprs: return []
+
+  ret = []
+  for line in [l.strip() for l in re.split(r'[;,\n]', exprs)]:
+    if not line or line[0] == '#': continue
+    pair = line.split('=')
+    if len(pair) != 2:
+      raise InvalidConstraints('"%s" is not valid equation (statement must contain "=")' % line)
+    lhs, rhs = map(sympify, pair)
+    if not isinstance(lhs, Symbol):
+      raise InvalidConstraints('lhs must be a symbol: "%s"' % pair[0])
+
+    for sym in [lhs] + list(rhs.free_symbols):
+      m = re.match(r'F(\d+)_(.*)', sym.name)
+      if not m:
+        raise InvalidConstraints('Unknown symbol: %s; '
+                                 'Function parameters are in format of "F1_name"'
+                                 % sym.name)
+      i, pn = int(m.group(1)), m.group(2)
+      if i > len(functions):
+        raise InvalidConstraints('Function id out of range: %s' % sym.name)
+      label, names = functions[i - 1]
+      if pn not in names:
+        raise InvalidConstraints('"%s" does not have such a parameter: %s' % (label, sym.name))
+
+      if sym == lhs:
+        lhs = i - 1, pn
+
+    ret.append(lhs + (pair[1].strip(),))
+
+  return ret
+
+
+def normalizeXY(x, y, window=None):
+  # window: function of x weighting the area, e.g. the sum of the
+  # normalize window functions
+  if window is None:
+    yn = np.ones(len(x))
+  else:
+    yn = window(x)
+    ynmax = max(yn)
+    if ynmax > 0:
+      yn = yn/max(yn)
+  sumy = sum(y*yn)
+  return y/(sum(y) if sumy == 0 else sumy)
+
+
+def normalizeLines(lines, bgsub=None, smooth=None, window=None):
+  # returns [(normalized y, smoothed y)]; areas are relative to the
+  # first line
+  ret = []
+  for i, line in enumerate(lines):
+    x, y = line.x, line.y
+    if bgsub:
+      f = bgsub.func(line, None, x)
+      y = y - f(line.x)
+    y = normalizeXY(x, y, window)
+    if i == 0: S = sum(y)
+    y = y/S
+    ret.append((y, smooth.smooth(x, y) if smooth else y))
+  return ret
+
+
+def createProblem(exprs, values, variables, constraints, x, y, fitRange):
+  # values: {parameter name: value} of each function; variables and the
+  # lhs of constraints are in "F1_name" format
+  fixed = {}
+  for i, params in enumerate(values):
+    for name, v in params.items():
+      fixed[FitProblem.symbolName(i, name)] = float(v)
+
+  x1, x2 = fitRange
+  mask = (x1 <= x) & (x <= x2)
+  return FitProblem(exprs, variables, constraints, fixed, x[mask], y[mask])
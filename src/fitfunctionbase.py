@@ -2,7 +2,7 @@ import uuid
 from PyQt5.QtCore import QObject, pyqtSignal
 import numpy as np
 
-from functions import blockable
+from functions import blockable, LRUCache
 from fitparameters import *
 from fitgraphitems import *
 from fitfuncdescriptor import FitFuncDescriptor
@@ -14,6 +14,10 @@ class FitFunctionBase(QObject):
   highlightChanged = pyqtSignal(QObject, bool)
   expr_excel = None
 
+  # lambdified expressions shared by all instances;
+  # key: (function class, argument order, fixed parameter set)
+  compiledFunctions = LRUCache(256)
+
   def __init__(self, view):
     super().__init__()
     self.view = view
@@ -23,6 +27,7 @@ class FitFunctionBase(QObject):
     self.handles = []
 
     self.plotCurveItem = None
+    self.graphItems = []
     self.highlighted = False
 
   def editableParams(self):
@@ -64,13 +69,15 @@ class FitFunctionBase(QObject):
     self.handles.append(handle)
 
   def getXrange(self, lines):
-    if len(lines) == 0: return 0, 1
-    l1, l2 = zip(*[l.getXrange() for l in lines])
+    ranges = [r for r in (l.getXrange() for l in lines) if r]
+    if len(ranges) == 0: return 0, 1
+    l1, l2 = zip(*ranges)
     return min(l1), max(l2)
 
   def getYrange(self, lines):
-    if len(lines) == 0: return 0, 1
-    l1, l2 = zip(*[l.getYrange() for l in lines])
+    ranges = [r for r in (l.getYrange() for l in lines) if r]
+    if len(ranges) == 0: return 0, 1
+    l1, l2 = zip(*ranges)
     return min(l1), max(l2)
 
   def getWidth(self, lines):
@@ -79,23 +86,31 @@ class FitFunctionBase(QObject):
     return x2 - x1
 
   def getGraphItems(self, x, color):
-    self.plotCurveItem = PlotCurveItem(x, self.y(x), self.view, color)
+    if self.plotCurveItem is None:
+      self.plotCurveItem = PlotCurveItem(x, self.y(x), self.view, color)
+    else:
+      if not np.array_equal(self.plotCurveItem.x, x):
+        self.plotCurveItem.setXY(x, self.y(x))
+      self.plotCurveItem.setPenColor(color)
     items = [self.plotCurveItem] + sum([h.getGraphItems(color) for h in self.handles], [])
 
-    touchables = [item for item in items if item.touchable]
-    for item in touchables:
-      item.hoveringChanged.connect(lambda: self.setHighlighted(
-        True in [item.hovering for item in touchables]))
-
+    for item in items:
+      if item.touchable and item not in self.graphItems:
+        item.hoveringChanged.connect(self.touchableHoveringChanged)
+    self.graphItems = items
     return items
 
+  def touchableHoveringChanged(self):
+    self.setHighlighted(True in [item.hovering for item in self.graphItems if item.touchable])
+
   def eval(self, name, formula, setArg, **kwargs):
     return FitParamFormula(name, formula, setArg, self.params, **kwargs)
 
   def eval2(self, name, formula, setEquations):
     return FitParamFormula2(name, formula, setEquations, self.params)
 
-  def parse_expr(self, expr):
+  @classmethod
+  def parse_expr(cls, expr):
     from sympy.parsing.sympy_parser import parse_expr
     from sympy import Symbol
     expr = parse_expr(expr)
@@ -103,15 +118,33 @@ class FitFunctionBase(QObject):
       expr = expr+Symbol('x')*0
     return expr
 
+  @classmethod
+  def exprArgs(cls):
+    if cls.__dict__.get('expr_args') is None:
+      expr = cls.parse_expr(cls.expr)
+      cls.expr_args = sorted([s.name for s in expr.free_symbols if s.name != 'x'])
+    return cls.expr_args
+
+  @classmethod
+  def compile(cls, args, fixed=()):
+    fixed = sorted(fixed)
+    def create():
+      from sympy import Symbol, lambdify
+      expr = cls.parse_expr(cls.expr)
+      return lambdify([Symbol(a) for a in ['x'] + list(args) + fixed], expr, 'numpy')
+    return cls.compiledFunctions.get((cls, tuple(args), frozenset(fixed)), create)
+
+  @classmethod
+  def evaluate(cls, x, params):
+    # params: {name: value} of the expression's parameters
+    args = cls.exprArgs()
+    return cls.samedim(cls.compile(args)(x, *[params[n] for n in args]), x)
+
   def lambdify(self, params):
     paramNames = [p.name for p in params]
-
-    from sympy import Symbol, lambdify
-    expr = self.parse_expr(self.expr)
-    fixed = [s.name for s in expr.free_symbols if s.name != 'x' and s.name not in paramNames]
+    fixed = sorted([n for n in self.exprArgs() if n not in paramNames])
     fixedv = [self.paramsNameMap[n].value() for n in fixed]
-    args = ['x'] + paramNames + fixed
-    func = lambdify([Symbol(a) for a in args], expr, 'numpy')
+    func = self.compile(paramNames, fixed)
 
     return lambda x, *vals: self.samedim(func(x, *(list(vals) + fixedv)), x)
 
@@ -124,20 +157,12 @@ class FitFunctionBase(QObject):
     return y
 
   def y(self, x, params=None):
-    from sympy import Symbol, lambdify
-    expr = self.parse_expr(self.expr)
-    args = [Symbol('x')]+[Symbol(p.name) for p in self.params]
-    func = lambdify(args, expr, 'numpy')
-
-    def getargs(override):
-      p_ = self.getParams()
-      if override:
-        p_.update(override)
-      return [p_[p.name] for p in self.params]
-
-    y = lambda x, params=None: self.samedim(func(x, *getargs(params)), x)
-    self.y = y
-    return y(x)
+    args = self.exprArgs()
+    if params:
+      values = [params[n] if n in params else self.paramsNameMap[n].value() for n in args]
+    else:
+      values = [self.paramsNameMap[n].value() for n in args]
+    return self.samedim(self.compile(args)(x, *values), x)
 
   def setHighlighted(self, highlighted):
     highlighted = bool(highlighted)
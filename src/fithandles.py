@@ -15,11 +15,19 @@ class FitHandleBase:
   def __init__(self, view):
     self.view = view
     self.view.pixelRatioChanged.connect(self.pixelRatioChanged)
+    self.graphItems = None, None
 
   def pixelRatioChanged(self):
     pass
 
   def getGraphItems(self, color):
+    # the items are kept while the color is the same; a kept item that
+    # leaves the scene while hovered is reset by GraphItemBase.itemChange
+    if self.graphItems[0] != color:
+      self.graphItems = color, self.createGraphItems(color)
+    return list(self.graphItems[1])
+
+  def createGraphItems(self, color):
     raise NotImplementedError()
 
 
@@ -30,7 +38,7 @@ class FitHandlePosition(FitHandleBase):
     self.x = x
     self.y = y
 
-  def getGraphItems(self, color):
+  def createGraphItems(self, color):
     return [DraggablePointItem(self.x, self.y, self.view, color)]
 
 
@@ -43,7 +51,7 @@ class FitHandleLine(FitHandleBase):
     self.x2 = x2
     self.y2 = y2
 
-  def getGraphItems(self, color):
+  def createGraphItems(self, color):
     return [LineItem(self.x1, self.y1, self.x2, self.y2, self.view, '#000'),
             DraggablePointItem(self.x2, self.y2, self.view, color)]
 
@@ -113,7 +121,7 @@ class FitHandleGradient(FitHandleBase):
     self.setXY.unblock()
     return self.calcX(theta), self.calcY(theta)
 
-  def getGraphItems(self, color):
+  def createGraphItems(self, color):
     return [LineItem(self.cx, self.cy, self.x, self.y, self.view, color),
             CircleItem(self.cx, self.cy, FitParamConst('r', self.length), self.view, color),
             DraggablePointItem(self.x, self.y, self.view, color, self.xyfilter)]
@@ -0,0 +1,520 @@
+import time
+import numpy as np
+
+from functions import LRUCache
+
+
+
+__all__ = ['FitProblem', 'CompiledFitModel', 'FitObjective',
+           'OptimizeInterrupted', 'FitMonitor', 'optimizeProblem', 'processPool',
+           'processManager', 'SerialExecutor', 'optimizeLines', 'searchBox', 'startPoints',
+           'multiStart', 'differentialEvolution']
+
+
+
+class FitProblem:
+  # Plain data only (strings, floats and arrays) so that a problem can be
+  # handed to another process.  Parameters are named in the same
+  # "F1_name" format as the constraints; exprs[0] is the function F1.
+  def __init__(self, exprs, variables, constraints, fixed, x, y):
+    self.exprs = list(exprs)
+    self.variables = list(variables)
+    self.constraints = list(constraints)
+    self.fixed = dict(fixed)
+    self.x = np.asarray(x, dtype=float)
+    self.y = np.asarray(y, dtype=float)
+
+  @classmethod
+  def symbolName(cls, funcIdx, paramName):
+    return 'F%d_%s' % (funcIdx + 1, paramName)
+
+
+
+class CompiledFitModel:
+  # one compiled model per distinct set of functions, variables and
+  # constraints; repeated optimize runs (and batches in a worker process)
+  # reuse it, including the lazily compiled derivatives
+  cache = LRUCache(32)
+
+  @classmethod
+  def get(cls, exprs, variables, constraints):
+    key = tuple(exprs), tuple(variables), tuple([tuple(c) for c in constraints])
+    return cls.cache.get(key, lambda: cls(exprs, variables, constraints))
+
+  def __init__(self, exprs, variables, constraints):
+    from sympy import Symbol, sympify, lambdify
+    from sympy.parsing.sympy_parser import parse_expr
+
+    x = Symbol('x')
+    varsyms = [Symbol(n) for n in variables]
+
+    resolved = {}
+    for lhs, rhs in constraints:
+      resolved[Symbol(lhs)] = sympify(rhs).xreplace(resolved)
+    self.constraintNames = [lhs for lhs, rhs in constraints]
+
+    varexprs, constexprs = [], []
+    for i, expr in enumerate(exprs):
+      expr = parse_expr(expr)
+      expr = expr.xreplace(dict([
+        (s, Symbol('F%d_%s' % (i + 1, s.name)))
+        for s in expr.free_symbols if s != x]))
+      expr = expr.xreplace(resolved)
+      if expr.free_symbols & set(varsyms):
+        varexprs.append(expr)
+      else:
+        constexprs.append(expr)
+
+    symbols = set()
+    for expr in varexprs + constexprs + list(resolved.values()):
+      symbols |= expr.free_symbols
+    symbols -= set(varsyms + [x])
+    self.fixedNames = sorted([s.name for s in symbols])
+    fixedsyms = [Symbol(n) for n in self.fixedNames]
+
+    self.variables = list(variables)
+    self.modelExpr = sum(varexprs)
+    self.model = lambdify((x, varsyms, fixedsyms), self.modelExpr, 'numpy')
+    self.args = x, varsyms, fixedsyms
+    self.jacobian = None
+    self.hessian = None
+    self.baseline = None
+    if constexprs:
+      self.baseline = lambdify((x, fixedsyms), sum(constexprs), 'numpy')
+    self.constraints = lambdify(
+      (varsyms, fixedsyms), [resolved[Symbol(n)] for n in self.constraintNames], 'numpy')
+
+  # Derivatives of the model with respect to the variables.  Constraints
+  # are already substituted into modelExpr, so the chain rule through
+  # constrained parameters is taken by sympy.  Compiled on first use,
+  # since gradient-free methods never need them.
+  def getJacobian(self):
+    if self.jacobian is None:
+      from sympy import lambdify
+      x, varsyms, fixedsyms = self.args
+      exprs = [self.modelExpr.diff(v) for v in varsyms]
+      self.jacobian = lambdify(self.args, exprs, 'numpy')
+    return self.jacobian
+
+  def getHessian(self):
+    if self.hessian is None:
+      from sympy import lambdify
+      x, varsyms, fixedsyms = self.args
+      indices, exprs = [], []
+      for i, vi in enumerate(varsyms):
+        di = self.modelExpr.diff(vi)
+        for j in range(i, len(varsyms)):
+          dij = di.diff(varsyms[j])
+          if dij != 0:
+            indices.append((i, j))
+            exprs.append(dij)
+      self.hessian = indices, lambdify(self.args, exprs, 'numpy')
+    return self.hessian
+
+
+
+class OptimizeInterrupted(Exception):
+  pass
+
+
+
+class FitMonitor:
+  # Watches the objective evaluations of a run: keeps the best point,
+  # reports it at most `rate` times per second and interrupts the run
+  # after cancel() or when the evaluation or time budget is used up.
+  # Picklable as long as progress is None; runs in worker processes are
+  # cancelled through cancelEvent, an Event of processManager().
+  pollInterval = .05
+
+  def __init__(self, progress=None, rate=10, maxfev=None, timeout=None, cancelEvent=None):
+    self.progress = progress
+    self.interval = 1/rate if rate else 0
+    self.maxfev = maxfev
+    self.timeout = timeout
+    self.cancelled = False
+    self.cancelEvent = cancelEvent
+    self.reset()
+
+  def reset(self):
+    self.nfev = 0
+    self.x, self.fun = None, np.inf
+    self.improved = False
+    self.started = self.reported = self.polled = time.monotonic()
+
+  def cancel(self):
+    self.cancelled = True
+    if self.cancelEvent is not None:
+      self.cancelEvent.set()
+
+  def share(self, cancelEvent):
+    # cancels cancelEvent together with this monitor
+    self.cancelEvent = cancelEvent
+    if self.cancelled:
+      cancelEvent.set()
+
+  def isCancelled(self):
+    if not self.cancelled and self.cancelEvent is not None:
+      # the event is a proxy; ask the manager only now and then
+      now = time.monotonic()
+      if now - self.polled >= self.pollInterval:
+        self.polled = now
+        self.cancelled = self.cancelEvent.is_set()
+    return self.cancelled
+
+  def stopReason(self):
+    if self.isCancelled():
+      return 'Cancelled'
+    if self.maxfev and self.nfev >= self.maxfev:
+      return 'Evaluation limit reached'
+    if self.timeout and time.monotonic() - self.started >= self.timeout:
+      return 'Time limit reached'
+    return None
+
+  def update(self, a, fun):
+    self.nfev += 1
+    if fun < self.fun:
+      self.x, self.fun = np.array(a, dtype=float), float(fun)
+      self.improved = True
+    if self.progress and self.improved:
+      now = time.monotonic()
+      if now - self.reported >= self.interval:
+        self.reported, self.improved = now, False
+        self.progress(self.x, self.fun)
+
+    reason = self.stopReason()
+    if reason:
+      raise OptimizeInterrupted(reason)
+
+  def result(self, a0, reason):
+    from scipy.optimize import OptimizeResult
+    x = np.array(a0, dtype=float) if self.x is None else self.x
+    return OptimizeResult(x=x, fun=self.fun, success=False, message=reason,
+                          nfev=self.nfev, interrupted=True)
+
+
+
+class FitObjective:
+  jacobianMethods = ['CG', 'BFGS', 'L-BFGS-B', 'TNC', 'SLSQP',
+                     'Newton-CG', 'dogleg', 'trust-ncg']
+  hessianMethods = ['Newton-CG', 'dogleg', 'trust-ncg']
+  leastSquaresMethods = {
+    'Least squares (TRF)': 'trf',
+    'Least squares (dogbox)': 'dogbox',
+    'Levenberg-Marquardt': 'lm'
+  }
+
+  def __init__(self, problem):
+    self.problem = problem
+    self.code = CompiledFitModel.get(problem.exprs, problem.variables, problem.constraints)
+    self.x = problem.x
+    self.c = np.array([problem.fixed[n] for n in self.code.fixedNames], dtype=float)
+
+    # functions without any free parameter do not change during the
+    # run; take them out of the target once instead of on every call
+    self.y = problem.y
+    if self.code.baseline is not None:
+      self.y = self.y - self.code.baseline(self.x, self.c)
+
+  def __reduce__(self):
+    return (self.__class__, (self.problem,))
+
+  def model(self, a):
+    return self.code.model(self.x, a, self.c)
+
+  def residuals(self, a):
+    return self.model(a) - self.y
+
+  def R2(self, a):
+    r = np.broadcast_to(self.residuals(a), self.y.shape)
+    return np.dot(r, r)
+
+  def jacobian(self, a):
+    values = self.code.getJacobian()(self.x, a, self.c)
+    J = np.empty((len(self.x), len(values)))
+    for i, v in enumerate(values):
+      J[:,i] = v
+    return J
+
+  def gradient(self, a):
+    r = np.broadcast_to(self.residuals(a), self.y.shape)
+    return 2*np.dot(r, self.jacobian(a))
+
+  def hessian(self, a):
+    r = np.broadcast_to(self.residuals(a), self.y.shape)
+    J = self.jacobian(a)
+    H = np.dot(J.T, J)
+    indices, func = self.code.getHessian()
+    for (i, j), v in zip(indices, func(self.x, a, self.c)):
+      h = np.sum(r*v)
+      H[i,j] += h
+      if i != j:
+        H[j,i] += h
+    return 2*H
+
+  def covariance(self, a):
+    r = np.broadcast_to(self.residuals(a), self.y.shape)
+    J = self.jacobian(a)
+    dof = len(r) - J.shape[1]
+    if dof <= 0:
+      return np.full((J.shape[1], J.shape[1]), np.inf)
+
+    # pseudo-inverse of J^T J by SVD, same as scipy.optimize.curve_fit
+    U, s, VT = np.linalg.svd(J, full_matrices=False)
+    s_ = s[s > np.finfo(float).eps*max(J.shape)*s[0]] if len(s) else s
+    VT = VT[:len(s_)]
+    return np.dot(VT.T/s_**2, VT)*np.dot(r, r)/dof
+
+  def constraintValues(self, a):
+    return [float(v) for v in self.code.constraints(a, self.c)]
+
+  def optimize(self, a0, method, bounds=None, monitor=None):
+    from scipy.optimize import minimize
+    R2, residuals = self.R2, self.residuals
+    if monitor is not None:
+      monitor.reset()
+      def R2(a):
+        v = self.R2(a)
+        monitor.update(a, v)
+        return v
+      def residuals(a):
+        r = self.residuals(a)
+        monitor.update(a, np.sum(np.broadcast_to(r, self.y.shape)**2))
+        return r
+
+    try:
+      if method in self.leastSquaresMethods:
+        return self.leastSquares(a0, self.leastSquaresMethods[method], bounds, residuals)
+
+      kwargs = {}
+      if method in self.jacobianMethods:
+        kwargs['jac'] = self.gradient
+      if method in self.hessianMethods:
+        kwargs['hess'] = self.hessian
+      return minimize(R2, a0, method=method, **kwargs)
+    except OptimizeInterrupted as ex:
+      return monitor.result(a0, str(ex))
+
+  def leastSquares(self, a0, method, bounds=None, residuals=None):
+    from scipy.optimize import least_squares
+    if bounds is None or method == 'lm':
+      bounds = (-np.inf, np.inf)
+
+    res = least_squares(residuals or self.residuals, a0, jac=self.jacobian,
+                        bounds=bounds, method=method, x_scale='jac')
+    res.residuals, res.fun = res.fun, self.R2(res.x)
+    res.cov = self.covariance(res.x)
+    res.stderr = np.sqrt(np.diag(res.cov))
+    return res
+
+
+
+def optimizeProblem(problem, a0, method, bounds=None, monitor=None):
+  from scipy.optimize import OptimizeResult
+  objective = FitObjective(problem)
+  res = objective.optimize(a0, method, bounds, monitor)
+  ret = OptimizeResult(
+    x=res.x, fun=float(res.fun), success=bool(res.success),
+    message=str(res.message), nfev=res.nfev,
+    constraintValues=objective.constraintValues(res.x))
+  for key in 'stderr', 'interrupted':
+    if key in res:
+      ret[key] = res[key]
+  return ret
+
+
+def processPool(maxWorkers=None):
+  # spawn, not fork: the parent is a multi-threaded Qt application
+  import multiprocessing
+  from concurrent.futures import ProcessPoolExecutor
+  return ProcessPoolExecutor(maxWorkers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def processManager():
+  # shares the cancel events of FitMonitor with the workers of processPool
+  import multiprocessing
+  return multiprocessing.get_context('spawn').Manager()
+
+
+class SerialExecutor:
+  # runs submitted calls immediately; stands in for a process pool
+  def submit(self, fn, *args):
+    from concurrent.futures import Future
+    fut = Future()
+    try:
+      fut.set_result(fn(*args))
+    except Exception as ex:
+      fut.set_exception(ex)
+    return fut
+
+
+def optimizeLines(jobs, method, bounds=None, executor=None, progress=None,
+                  createMonitor=None, cancelled=None):
+  # jobs: [[name, problem, seeded]]; lines that are not seeded are started
+  # from the result of their neighbour.  progress(name, result) is called
+  # with an OptimizeResult or the exception of each line.
+  from concurrent.futures import wait, FIRST_COMPLETED
+  if executor is None:
+    executor = SerialExecutor()
+
+  futures = {}
+  def submit(i):
+    name, problem, seeded = jobs[i]
+    jobs[i][2] = True
+    a0 = np.array([problem.fixed[n] for n in problem.variables])
+    monitor = createMonitor() if createMonitor else None
+    fut = executor.submit(optimizeProblem, problem, a0, method, bounds, monitor)
+    futures[fut] = i
+
+  for i, (name, problem, seeded) in enumerate(jobs):
+    if seeded:
+      submit(i)
+
+  while futures:
+    done, pending = wait(futures, timeout=.1, return_when=FIRST_COMPLETED)
+    if cancelled and cancelled():
+      for fut in pending:
+        if fut.cancel():
+          futures.pop(fut)
+    for fut in done:
+      i = futures.pop(fut)
+      name, problem, seeded = jobs[i]
+      try:
+        res = fut.result()
+      except Exception as ex:
+        res = ex
+      if progress:
+        progress(name, res)
+
+      fixed = dict(problem.fixed)
+      if not isinstance(res, Exception):
+        fixed.update(zip(problem.variables, res.x))
+        fixed.update(zip([lhs for lhs, rhs in problem.constraints], res.constraintValues))
+      for j in i - 1, i + 1:
+        if cancelled and cancelled():
+          break
+        if 0 <= j < len(jobs) and not jobs[j][2]:
+          p = jobs[j][1]
+          jobs[j][1] = FitProblem(p.exprs, p.variables, p.constraints, fixed, p.x, p.y)
+          submit(j)
+
+
+def searchBox(a0, bounds=None, spread=.5):
+  # finite box for sampling start points; unbounded sides extend
+  # |a0|*spread (or spread for zero) from a0
+  a0 = np.asarray(a0, dtype=float)
+  lb, ub = bounds if bounds is not None else (-np.inf, np.inf)
+  lb, ub = np.broadcast_to(lb, a0.shape), np.broadcast_to(ub, a0.shape)
+  w = np.where(a0 != 0, np.abs(a0)*spread, spread)
+  lo = np.where(np.isfinite(lb), lb, a0 - w)
+  hi = np.where(np.isfinite(ub), ub, a0 + w)
+  return lo, np.maximum(hi, lo + w)
+
+
+def startPoints(a0, bounds, count, sampling='sobol', seed=None):
+  # a0 followed by count-1 points sampled in searchBox()
+  lo, hi = searchBox(a0, bounds)
+  n, d = count - 1, len(lo)
+  if n <= 0:
+    return np.array([a0], dtype=float)
+
+  try:
+    import warnings
+    from scipy.stats import qmc
+    if sampling == 'sobol':
+      sampler = qmc.Sobol(d, seed=seed)
+    else:
+      sampler = qmc.LatinHypercube(d, seed=seed)
+    with warnings.catch_warnings():
+      # Sobol prefers powers of two
+      warnings.simplefilter('ignore')
+      u = sampler.random(n)
+  except ImportError:
+    # scipy < 1.7; plain latin hypercube
+    rnd = np.random.RandomState(seed)
+    u = (np.argsort(rnd.rand(n, d), axis=0) + rnd.rand(n, d))/n
+
+  return np.vstack([np.clip(a0, lo, hi), lo + u*(hi - lo)])
+
+
+def multiStart(problem, a0, method, bounds, count, sampling, executor, monitor=None,
+               createMonitor=None):
+  # monitor sees the result of each local fit; each local fit runs with
+  # a monitor of createMonitor()
+  from concurrent.futures import wait
+  pending = set([executor.submit(optimizeProblem, problem, p, method, bounds,
+                                 createMonitor() if createMonitor else None)
+                 for p in startPoints(a0, bounds, count, sampling)])
+
+  results, error = [], None
+  while pending:
+    done, pending = wait(pending, timeout=.1)
+    try:
+      for fut in done:
+        try:
+          results.append(fut.result())
+        except Exception as ex:
+          error = ex
+          continue
+        if monitor:
+          monitor.update(results[-1].x, results[-1].fun)
+      reason = monitor and monitor.stopReason()
+      if reason:
+        raise OptimizeInterrupted(reason)
+    except OptimizeInterrupted as ex:
+      error = ex
+      for fut in pending:
+        fut.cancel()
+      break
+  if not results:
+    if isinstance(error, OptimizeInterrupted):
+      return monitor.result(a0, str(error))
+    raise error
+
+  best = min(results, key=lambda res: res.fun)
+  best.nfev = sum([res.nfev for res in results])
+  best.nstarts = len(results)
+  if isinstance(error, OptimizeInterrupted):
+    best.success, best.message, best.interrupted = False, str(error), True
+  return best
+
+
+def differentialEvolution(problem, a0, bounds, executor=None, popsize=15, monitor=None,
+                          maxfev=None):
+  # the initial population contains a0; members are evaluated through
+  # executor.map when an executor is given.  monitor sees the best
+  # member of each generation.  maxfev limits the generations so that
+  # the population is evaluated at most about maxfev times
+  import inspect
+  from scipy.optimize import differential_evolution, OptimizeResult
+  objective = FitObjective(problem)
+  lo, hi = searchBox(a0, bounds)
+  size = max(popsize*len(lo), 5)
+  init = startPoints(a0, (lo, hi), size, 'lhs')
+
+  kwargs = {}
+  if 'workers' not in inspect.signature(differential_evolution).parameters:
+    # scipy < 1.2 takes neither an init array nor workers; the population
+    # is a latin hypercube evaluated serially
+    init, executor = 'latinhypercube', None
+    kwargs['popsize'] = -(-size//len(lo))
+  if maxfev:
+    kwargs['maxiter'] = max(maxfev//size - 1, 1)
+  if executor is not None:
+    import os
+    chunksize = max(1, size//(4*(os.cpu_count() or 1)))
+    kwargs['workers'] = lambda f, xs: executor.map(f, xs, chunksize=chunksize)
+    kwargs['updating'] = 'deferred'
+
+  if monitor:
+    def callback(xk, convergence=None):
+      try:
+        monitor.update(xk, objective.R2(xk))
+      except OptimizeInterrupted:
+        return True
+    kwargs['callback'] = callback
+
+  res = differential_evolution(objective.R2, list(zip(lo, hi)), init=init, **kwargs)
+  return OptimizeResult(
+    x=res.x, fun=float(res.fun), success=bool(res.success),
+    message=str(res.message), nfev=res.nfev,
+    constraintValues=objective.constraintValues(res.x))
@@ -3,7 +3,7 @@ import operator
 from PyQt5.QtCore import QObject, pyqtSignal
 import numpy as np
 
-from functions import blockable
+from functions import blockable, LRUCache
 from settingitems import *
 
 
@@ -104,39 +104,51 @@ class FitParamFunc(FitParam):
 
 
 class FitParamFormula(FitParamFunc):
-  def __init__(self, name, formula, setArg, refargs, **kwargs):
-    from sympy.parsing.sympy_parser import parse_expr
-    from sympy.solvers import solve
-    from sympy import Symbol, Eq, lambdify
+  # parsed and lambdified formulas, shared by all instances;
+  # key: (formula, name of the parameter set by the inverse function)
+  compiledFormulas = LRUCache(256)
 
-    expr = parse_expr(formula)
-    args = list(expr.free_symbols)
-    func = lambdify(args, expr, 'numpy')
+  def __init__(self, name, formula, setArg, refargs, **kwargs):
+    args, func, args_i, func_i = self.compile(formula, setArg.name if setArg else None)
 
     params = dict([(a.name, a) for a in refargs])
-    refargs = [params[a.name] for a in args]
-
-    if setArg:
-      expr_i = solve(Eq(expr, Symbol('__')), Symbol(setArg.name))
-      if len(expr_i) != 1:
-        raise RuntimeError('Could not determine the inverse function of "y=%s"' % formula)
-      expr_i = expr_i[0]
-      args_i = list(expr_i.free_symbols)
-      func_i = lambdify(args_i, expr_i, 'numpy')
-    else:
-      func_i = None
+    refargs = [params[a] for a in args]
 
-    get_ = lambda: func(*[params[a.name].value() for a in args])
+    get_ = lambda: func(*[params[a].value() for a in args])
 
     if setArg:
       tosetval = lambda v: func_i(*[
-        (v if a.name == '__' else params[a.name].value()) for a in args_i])
+        (v if a == '__' else params[a].value()) for a in args_i])
       set_ = lambda v: setArg.setValue(tosetval(v))
     else:
       set_ = None
 
     super().__init__(name, get_, set_, refargs, **kwargs)
 
+  @classmethod
+  def compile(cls, formula, setArgName):
+    def create():
+      from sympy.parsing.sympy_parser import parse_expr
+      from sympy.solvers import solve
+      from sympy import Symbol, Eq, lambdify
+
+      expr = parse_expr(formula)
+      args = list(expr.free_symbols)
+      func = lambdify(args, expr, 'numpy')
+
+      if setArgName:
+        expr_i = solve(Eq(expr, Symbol('__')), Symbol(setArgName))
+        if len(expr_i) != 1:
+          raise RuntimeError('Could not determine the inverse function of "y=%s"' % formula)
+        expr_i = expr_i[0]
+        args_i = list(expr_i.free_symbols)
+        func_i = lambdify(args_i, expr_i, 'numpy')
+      else:
+        args_i, func_i = [], None
+
+      return [a.name for a in args], func, [a.name for a in args_i], func_i
+    return cls.compiledFormulas.get((formula, setArgName), create)
+
 
 
 class FitParamFormula2(FitParam):
@@ -146,10 +158,16 @@ class FitParamFormula2(FitParam):
     self.setEquations = self.parseEquations(setEquations, refargs)
     self.refargs = refargs
 
+  # key: (kind, formula or equations, names of refargs)
+  compiledFormulas = LRUCache(256)
+
   @classmethod
   def lambdify(cls, formula, refargs):
-    from sympy import sympify, lambdify
-    func = lambdify([a.name for a in refargs], sympify(formula), 'numpy')
+    def create():
+      from sympy import sympify, lambdify
+      return lambdify([a.name for a in refargs], sympify(formula), 'numpy')
+    func = cls.compiledFormulas.get(
+      ('formula', formula, tuple([a.name for a in refargs])), create)
     def wrap():
       return func(*[a.value() for a in refargs])
     return wrap
@@ -161,20 +179,24 @@ class FitParamFormula2(FitParam):
 
     refargmap = dict([(a.name, a) for a in refargs])
 
-    from sympy import Symbol, sympify, lambdify
-    equations = []
-    for pair in [l.strip().split('=') for l in re.split(r'[;,\n]', exprs)]:
-      if len(pair) != 2:
-        raise InvalidConstraints('"%s" is not valid equation (statement must contain "=")' % '='.join(pair))
-      lhs, rhs = map(sympify, pair)
-      if not isinstance(lhs, Symbol):
-        raise InvalidConstraints('lhs must be a symbol: "%s"' % pair[0])
-      args1 = [s.name for s in rhs.free_symbols if s.name in refargmap]
-      args2 = [s.name for s in rhs.free_symbols if s.name not in refargmap]
-      func = lambdify(args1+args2, rhs, 'numpy')
-      equations.append((lhs.name, func, [refargmap[n] for n in args1], args2))
-
-    return equations
+    def create():
+      from sympy import Symbol, sympify, lambdify
+      equations = []
+      for pair in [l.strip().split('=') for l in re.split(r'[;,\n]', exprs)]:
+        if len(pair) != 2:
+          raise InvalidConstraints('"%s" is not valid equation (statement must contain "=")' % '='.join(pair))
+        lhs, rhs = map(sympify, pair)
+        if not isinstance(lhs, Symbol):
+          raise InvalidConstraints('lhs must be a symbol: "%s"' % pair[0])
+        args1 = [s.name for s in rhs.free_symbols if s.name in refargmap]
+        args2 = [s.name for s in rhs.free_symbols if s.name not in refargmap]
+        func = lambdify(args1+args2, rhs, 'numpy')
+        equations.append((lhs.name, func, args1, args2))
+      return equations
+
+    key = ('equations', exprs, tuple(sorted(refargmap)))
+    return [(lhs, func, [refargmap[n] for n in args1], args2)
+            for lhs, func, args1, args2 in cls.compiledFormulas.get(key, create)]
 
   def setValue(self, newval):
     variables = dict([('_%s' % a.name, a.value()) for a in self.refargs])
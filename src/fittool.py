@@ -10,20 +10,18 @@ import log
 from line import Line
 from toolbase import ToolBase
 import fitfunctions
+from fitobjective import *
+from fitcore import *
+from peakmodel import *
 from fitgraphitems import *
 from settingitems import *
-from functions import blockable
-
-
-
-class InvalidConstraints(Exception):
-  def __init__(self, msg):
-    super().__init__()
-    self.reason = msg
+from functions import blockable, LRUCache
 
 
 
 class OptimizeThread(QThread):
+  progress = pyqtSignal(object, float)
+
   def __init__(self, tool, params):
     super().__init__()
     self.tool = tool
@@ -32,107 +30,205 @@ class OptimizeThread(QThread):
     self.exc_info = None
 
   @classmethod
-  def parseConstraints(cls, constraints, variables, tool):
-    from sympy import Symbol, sympify
-    exprs = constraints.strip()
-    if not exprs: return []
-
-    constraints = []
-    for line in [l.strip() for l in re.split(r'[;,\n]', exprs)]:
-      if not line or line[0] == '#': continue
-      pair = line.split('=')
-      if len(pair) != 2:
-        raise InvalidConstraints('"%s" is not valid equation (statement must contain "=")' % line)
-      lhs, rhs = map(sympify, pair)
-      if not isinstance(lhs, Symbol):
-        raise InvalidConstraints('lhs must be a symbol: "%s"' % pair[0])
-
-      params = []
-      subs = []
-      for sym in [lhs] + list(rhs.free_symbols):
-        m = re.match(r'F(\d+)_(.*)', sym.name)
-        if not m:
-          raise InvalidConstraints('Unknown symbol: %s; '
-                                   'Function parameters are in format of "F1_name"'
-                                   % sym.name)
-        i, pn = int(m.group(1)), m.group(2)
-        if i > len(tool.peakFunctions):
-          raise InvalidConstraints('Function id out of range: %s' % sym.name)
-        f = tool.peakFunctions[i - 1]
-        if pn not in f.paramsNameMap:
-          raise InvalidConstraints('"%s" does not have such a parameter: %s' % (f.label, sym.name))
-        p = f.paramsNameMap[pn]
-
-        if sym == lhs:
-          lhs = p
-        elif p in variables:
-          params.append((sym.name, variables.index(p)))
-        else:
-          subs.append((sym, p.value()))
-
-      constraints.append((lhs, rhs.subs(subs), params))
-
-    return constraints
-
-  def wrapFuncWithConstraints(self, func, params, constraints):
-    cparams = [lhs for lhs, rhs, subs in constraints if lhs in func.params]
-    uparams = [p for p in params if p in func.params and p not in cparams]
-
-    func_ = func.lambdify(uparams + cparams)
-
-    pindices = [params.index(p) for p in uparams]
-    cindices = [i for i, (l, r, s) in enumerate(constraints) if l in cparams]
-    def wrap(x, values, cvalues):
-      args = [values[i] for i in pindices]
-      args += [cvalues[i] for i in cindices]
-      return func_(x, *args)
-
-    return wrap
+  def parseConstraints(cls, constraints, tool):
+    functions = tool.peakFunctions
+    return [(functions[i].paramsNameMap[pn], rhs) for i, pn, rhs in parseConstraints(
+      constraints, [(f.label, f.paramsNameMap) for f in functions])]
 
   def calcConstraintValues(self, pvalues):
-    pairs = []
-    for lhs, rhs, subs in self.constraints:
-      v = rhs.subs([(n, pvalues[i]) for n, i in subs])
-      pairs.append((lhs, float(v)))
-    return pairs
+    return list(zip(self.cparams, self.objective.constraintValues(pvalues)))
 
   def prepare(self):
     line = self.tool.activeLine()
     params = self.params
 
-    self.constraints = self.parseConstraints(self.tool.constraints.strValue(), params, self.tool)
-    constraints = self.constraints
-    for lhs, rhs, subs in constraints:
+    constraints = self.parseConstraints(self.tool.constraints.strValue(), self.tool)
+    for lhs, rhs in constraints:
       if lhs in params:
         params.remove(lhs)
+    self.cparams = [lhs for lhs, rhs in constraints]
 
     logging.debug('Optimize: %s using %s' % (
       ','.join(['%s' % p.name for p in params]), self.tool.optimizeMethod))
 
-    self.srcfuncs = []
-    funcs = []
-    for func in self.tool.peakFunctions:
-      for p in params + [lhs for lhs, rhs, subs in constraints]:
-        if p in func.params:
-          self.srcfuncs.append(func)
-          break
-      funcs.append(self.wrapFuncWithConstraints(func, params, constraints))
+    self.srcfuncs = [func for func in self.tool.peakFunctions
+                     if set(func.params) & set(params + self.cparams)]
 
-    x, y = np.array([(x, y) for x, y in zip(line.x, line.y2)
-                     if self.tool.fitRange.inRange(x)]).T
-    def R2(a):
-      cvals = [v for p, v in self.calcConstraintValues(a)]
-      return np.sum((np.sum([f(x, a, cvals) for f in funcs], axis=0) - y)**2)
-    a0 = np.array([p.value() for p in params])
+    self.problem = self.tool.createProblem(line, params, constraints)
+    self.objective = FitObjective(self.problem)
 
-    self.R2 = R2
-    self.a0 = a0
+    self.R2 = self.objective.R2
+    self.a0 = np.array([p.value() for p in params])
+    self.bounds = self.tool.paramBounds(params)
     self.optimizeMethod = self.tool.optimizeMethod
+    self.monitor = self.createMonitor()
+    if FitObjective.leastSquaresMethods.get(self.optimizeMethod) == 'lm' \
+       and np.isfinite(self.bounds).any():
+      logging.warning('Levenberg-Marquardt does not support bounds;'
+                      ' min/max of the parameters are ignored')
+
+  def createMonitor(self):
+    return FitMonitor(lambda x, fun: self.progress.emit(x, fun), self.tool.progressRate,
+                      self.tool.maxEvaluations, self.tool.timeLimit)
+
+  def cancel(self):
+    self.monitor.cancel()
 
   def run(self):
     try:
-      from scipy.optimize import minimize
-      self.res = minimize(self.R2, self.a0, method=self.optimizeMethod)
+      self.res = self.objective.optimize(self.a0, self.optimizeMethod, self.bounds, self.monitor)
+    except:
+      self.exc_info = sys.exc_info()
+
+
+
+class GlobalOptimizeThread(OptimizeThread):
+  def prepare(self):
+    super().prepare()
+    self.globalMode = self.tool.globalMode
+    self.startCount = self.tool.startCount
+    logging.debug('Global search: %s (%d starts)' % (self.globalMode, self.startCount))
+
+  def createMonitor(self):
+    # the evaluation budget applies to each local fit, not to the search
+    return FitMonitor(lambda x, fun: self.progress.emit(x, fun), self.tool.progressRate,
+                      None, self.tool.timeLimit)
+
+  def createLocalMonitor(self):
+    return FitMonitor(None, 0, self.tool.maxEvaluations, self.tool.timeLimit,
+                      self.monitor.cancelEvent)
+
+  def run(self):
+    try:
+      # the workers are shut down before the manager of the cancel event
+      with processManager() as manager, processPool() as executor:
+        self.monitor.share(manager.Event())
+        if self.globalMode == 'de':
+          self.res = differentialEvolution(self.problem, self.a0, self.bounds, executor,
+                                           monitor=self.monitor, maxfev=self.tool.maxEvaluations)
+        else:
+          self.res = multiStart(self.problem, self.a0, self.optimizeMethod, self.bounds,
+                                self.startCount, self.globalMode, executor, self.monitor,
+                                self.createLocalMonitor)
+    except:
+      self.exc_info = sys.exc_info()
+    finally:
+      self.monitor.cancelEvent = None
+
+
+
+class BatchOptimizeThread(QThread):
+  progress = pyqtSignal(str, object)
+
+  def __init__(self, tool, params):
+    super().__init__()
+    self.tool = tool
+    self.params = params
+    self.cancelled = False
+    self.cancelEvent = None
+    self.prepare()
+    self.exc_info = None
+
+  def cancel(self):
+    self.cancelled = True
+    if self.cancelEvent is not None:
+      self.cancelEvent.set()
+
+  def createMonitor(self):
+    # budget per line
+    return FitMonitor(None, 0, self.tool.maxEvaluations, self.tool.timeLimit, self.cancelEvent)
+
+  def prepare(self):
+    tool = self.tool
+    constraints = OptimizeThread.parseConstraints(tool.constraints.strValue(), tool)
+    self.cparams = [lhs for lhs, rhs in constraints]
+    self.params = [p for p in self.params if p not in self.cparams]
+    self.optimizeMethod = tool.optimizeMethod
+    self.bounds = tool.paramBounds(self.params)
+
+    # lines without stored parameters are started from the result of
+    # their neighbour
+    self.jobs = []
+    for line in tool.lines:
+      funcParams = tool.peakFuncParams.get(line.name)
+      problem = tool.createProblem(line, self.params, constraints, funcParams)
+      self.jobs.append([line.name, problem, funcParams is not None])
+    if True not in [seeded for name, problem, seeded in self.jobs]:
+      for job in self.jobs:
+        job[2] = True
+
+    logging.debug('Optimize %d lines: %s using %s' % (
+      len(self.jobs), ','.join([p.name for p in self.params]), self.optimizeMethod))
+
+  def run(self):
+    try:
+      with processManager() as manager, processPool() as executor:
+        self.cancelEvent = manager.Event()
+        if self.cancelled:
+          self.cancelEvent.set()
+        optimizeLines(self.jobs, self.optimizeMethod, self.bounds, executor,
+                      self.progress.emit, self.createMonitor, lambda: self.cancelled)
+    except:
+      self.exc_info = sys.exc_info()
+    finally:
+      self.cancelEvent = None
+
+
+
+class ContinuationOptimizeThread(BatchOptimizeThread):
+  def __init__(self, tool, params, extrapolate=False):
+    self.extrapolate = extrapolate
+    self.monitor = None
+    super().__init__(tool, params)
+
+  def prepare(self):
+    super().prepare()
+
+    jobs = []
+    for name, problem, seeded in self.jobs:
+      p = self.tool.getPressure(name).value()
+      if p is None:
+        logging.warning('Pressure is not set; skip %s' % name)
+        continue
+      jobs.append([name, problem, p])
+    self.jobs = sorted(jobs, key=lambda job: job[2])
+
+  def startPoint(self, problem, pressure, results):
+    a0 = np.array([problem.fixed[n] for n in problem.variables])
+    if len(results) >= 1:
+      a0 = results[-1][1]
+    if self.extrapolate and len(results) >= 2:
+      (p1, a1), (p2, a2) = results[-2:]
+      if p1 != p2:
+        a0 = a2 + (a2 - a1)*(pressure - p2)/(p2 - p1)
+
+    # least_squares does not start outside of the bounds
+    lower, upper = self.bounds
+    lower = np.where(np.isfinite(lower), lower + 1e-10*np.maximum(np.abs(lower), 1), lower)
+    upper = np.where(np.isfinite(upper), upper - 1e-10*np.maximum(np.abs(upper), 1), upper)
+    return np.clip(a0, np.minimum(lower, upper), np.maximum(lower, upper))
+
+  def cancel(self):
+    super().cancel()
+    if self.monitor:
+      self.monitor.cancel()
+
+  def run(self):
+    try:
+      results = []
+      for name, problem, pressure in self.jobs:
+        a0 = self.startPoint(problem, pressure, results)
+        self.monitor = self.createMonitor()
+        if self.cancelled:
+          break
+        try:
+          res = optimizeProblem(problem, a0, self.optimizeMethod, self.bounds, self.monitor)
+          if self.cancelled:
+            break
+          results.append((pressure, res.x))
+        except Exception as ex:
+          res = ex
+        self.progress.emit(name, res)
     except:
       self.exc_info = sys.exc_info()
 
@@ -153,14 +249,24 @@ class FitTool(ToolBase):
     'TNC',
     'COBYLA',
     'SLSQP',
-    # requires Jacobian
-    # 'Newton-CG',
-    # 'dogleg',
-    # 'trust-ncg'
+    'Newton-CG',
+    'dogleg',
+    'trust-ncg',
+    'Least squares (TRF)',
+    'Least squares (dogbox)',
+    'Levenberg-Marquardt'
+  ]
+
+  globalModes = [
+    (None, 'Single start'),
+    ('sobol', 'Multi-start (Sobol)'),
+    ('lhs', 'Multi-start (Latin hypercube)'),
+    ('de', 'Differential evolution')
   ]
 
   intersectionsUpdated = pyqtSignal()
   peakPositionsUpdated = pyqtSignal()
+  batchProgress = pyqtSignal(int, int)
 
 
   def __init__(self, graphWidget):
@@ -172,19 +278,26 @@ class FitTool(ToolBase):
     self.sumCurveItem = None
     self.diffCurveItem = None
     self.lineCurveItems = []
+    self.prevLineCurveItems = {}
     self.activeLineName = None
     self.peakFuncParams = {}
     self.pressures = {}
     self.mode = 'peaks'
     self.plotParams = None
     self.optimizer = None
+    self.peakModels = LRUCache(8)
 
     self.optimizeMethod = self.optimizeMethods[0]
+    self.globalMode = None
+    self.startCount = 32
+    self.progressRate = 10
+    self.maxEvaluations = None
+    self.timeLimit = None
     self.R2 = SettingItemFloat('R2', 'R^2', '0')
     self.IAD = SettingItemFloat('IAD', 'IAD', '0')
-    self.addSettingItem(SettingItemRange('fitRange', 'Fit range', '-inf:inf'))
+    self.addSettingItem(SettingItemRange('fitRange', 'Fit range', settingDefaults['fitRange']))
     self.addSettingItem(SettingItemStr('isecFunc', 'Function', '1'))
-    self.addSettingItem(SettingItemStr('constraints', 'Constraints', '',
+    self.addSettingItem(SettingItemStr('constraints', 'Constraints', settingDefaults['constraints'],
                                        validator=self.validateConstraints))
     self.isecPoints = []
     self.peakPos = []
@@ -202,14 +315,20 @@ class FitTool(ToolBase):
     self.updateDiffCurve()
 
   def clear(self):
+    self.prevLineCurveItems = dict((l.name, (l, item)) for l, item in zip(self.lines, self.lineCurveItems))
+    assert len(self.prevLineCurveItems) == len(self.lines), 'duplicate line names'
     super().clear()
     self.sumCurveItem = None
     self.diffCurveItem = None
     self.lineCurveItems = []
 
-  def add(self, *args):
-    line = super().add(*args)
-    item = PlotCurveItem(line.x, line.y, self.graphWidget, '#000', line.name)
+  def addLine(self, line):
+    line = super().addLine(line)
+    prev, item = self.prevLineCurveItems.pop(line.name, (None, None))
+    if item is None:
+      item = PlotCurveItem(line.x, line.y, self.graphWidget, '#000', line.name)
+    elif prev is not line:
+      item.setXY(line.x, line.y)
     self.lineCurveItems.append(item)
     return line
 
@@ -228,7 +347,7 @@ class FitTool(ToolBase):
 
   def validateConstraints(self, value):
     try:
-      OptimizeThread.parseConstraints(value, [], self)
+      OptimizeThread.parseConstraints(value, self)
       return QValidator.Acceptable, 'OK'
     except InvalidConstraints as ex:
       return QValidator.Invalid, ex.reason
@@ -244,37 +363,157 @@ class FitTool(ToolBase):
     if not line:
       raise RuntimeError('Line not selected')
 
-    self.optimizer = OptimizeThread(self, params)
+    if self.globalMode:
+      self.optimizer = GlobalOptimizeThread(self, params)
+    else:
+      self.optimizer = OptimizeThread(self, params)
     self.optimizer.callback = callback
+    self.optimizer.progress.connect(self.optimizeProgress)
     self.optimizer.finished.connect(self.optimizeComplete)
     self.optimizer.start()
 
-  def optimizeComplete(self):
+  def cancelOptimize(self):
+    if self.optimizer:
+      self.optimizer.cancel()
+
+  def optimizeAllLines(self, params, callback=None, continuation=False, extrapolate=False):
+    if self.optimizer:
+      raise RuntimeError('Now an optimize job is running')
+
+    if not self.lines:
+      raise RuntimeError('No lines to fit')
+
+    if continuation:
+      self.optimizer = ContinuationOptimizeThread(self, params, extrapolate)
+    else:
+      self.optimizer = BatchOptimizeThread(self, params)
+    self.optimizer.callback = callback
+    self.optimizer.done = 0
+    self.optimizer.progress.connect(self.batchOptimizeProgress)
+    self.optimizer.finished.connect(self.batchOptimizeComplete)
+    self.optimizer.start()
+
+  def batchOptimizeProgress(self, name, res):
+    optimizer = self.optimizer
+    optimizer.done += 1
+
+    if isinstance(res, Exception):
+      logging.error('Optimize failed: %s (%s)' % (name, res))
+    else:
+      logging.debug('Optimize done: %s (%d evaluations): %s' % (
+        name, res.nfev, ','.join(map(str, res.x))))
+      if res.get('interrupted'):
+        logging.warning('Optimize stopped: %s (%s)' % (name, res.message))
+      self.storeLineParams(name, list(zip(optimizer.params, res.x)) +
+                           list(zip(optimizer.cparams, res.constraintValues)))
+
+    self.batchProgress.emit(optimizer.done, len(optimizer.jobs))
+
+  def batchOptimizeComplete(self):
     optimizer = self.optimizer
     self.optimizer = None
 
     if optimizer.exc_info:
       log.logException(*optimizer.exc_info)
-      return
 
-    logging.debug('Optimize done: %s' % ','.join(map(str, optimizer.res.x)))
+    self.restorePeakFuncParams()
+    self.updateSumCurve()
+    self.updateDiffCurve()
+    self.calcPeakPositions()
+
+    if optimizer.callback:
+      optimizer.callback(optimizer.exc_info is None)
+
+  def storeLineParams(self, name, values):
+    # go through the function objects so that dependent parameters
+    # (area, handles, ...) are stored consistently
+    params = self.peakFuncParams.setdefault(name, {})
+    current = [func.getParams() for func in self.peakFunctions]
+    self.parameterChanged_peaks.block()
+    try:
+      for func in self.peakFunctions:
+        if func.id in params:
+          func.setParams(params[func.id])
+      for p, v in values:
+        p.setValue(v)
+      for func in self.peakFunctions:
+        params[func.id] = func.getParams()
+      for func, p in zip(self.peakFunctions, current):
+        func.setParams(p)
+    finally:
+      self.parameterChanged_peaks.unblock()
 
+  def createProblem(self, line, params, constraints, funcParams=None):
+    functions = self.peakFunctions
+    symbol = lambda p: FitProblem.symbolName(functions.index(p.func), p.name)
+
+    values = []
+    for func in functions:
+      v = funcParams.get(func.id) if funcParams else None
+      values.append(func.getParams() if v is None else v)
+
+    return createProblem(
+      [func.expr for func in functions], values,
+      [symbol(p) for p in params],
+      [(symbol(lhs), rhs) for lhs, rhs in constraints],
+      line.x, line.y2, self.fitRange.value())
+
+  @classmethod
+  def paramBounds(cls, params):
+    return (np.array([-np.inf if p.min_ is None else p.min_ for p in params]),
+            np.array([np.inf if p.max_ is None else p.max_ for p in params]))
+
+  def setOptimizedValues(self, optimizer, x):
     self.parameterChanged_peaks.block()
-    for p, v in zip(optimizer.params, optimizer.res.x):
+    for p, v in zip(optimizer.params, x):
       p.setValue(v)
-    for p, v in optimizer.calcConstraintValues(optimizer.res.x):
+    for p, v in optimizer.calcConstraintValues(x):
       p.setValue(v)
     self.parameterChanged_peaks.unblock()
 
     for f in optimizer.srcfuncs:
       self.parameterChanged_peaks(f)
 
+  def optimizeProgress(self, x, fun):
+    if self.optimizer:
+      self.setOptimizedValues(self.optimizer, x)
+
+  def optimizeComplete(self):
+    optimizer = self.optimizer
+    self.optimizer = None
+
+    if optimizer.exc_info:
+      log.logException(*optimizer.exc_info)
+      if optimizer.callback:
+        optimizer.callback(False, optimizer.params, None)
+      return
+
+    logging.debug('Optimize done: %s' % ','.join(map(str, optimizer.res.x)))
+    if optimizer.res.get('interrupted'):
+      logging.info('Optimize stopped: %s (%d evaluations)' % (
+        optimizer.res.message, optimizer.res.nfev))
+    if hasattr(optimizer.res, 'nstarts'):
+      logging.info('Best of %d starts: R2=%g (%d evaluations)' % (
+        optimizer.res.nstarts, optimizer.res.fun, optimizer.res.nfev))
+    if hasattr(optimizer.res, 'stderr'):
+      logging.info('Standard errors:\n%s' % '\n'.join([
+        '%s = %g \u00b1 %g' % (name, v, e) for name, v, e in zip(
+          optimizer.problem.variables, optimizer.res.x, optimizer.res.stderr)]))
+
+    self.setOptimizedValues(optimizer, optimizer.res.x)
     self.calcIntersections()
     self.calcPeakPositions()
 
     if optimizer.callback:
       optimizer.callback(optimizer.exc_info is None, optimizer.params, optimizer.res.x)
 
+  def peakModel(self, functions=None):
+    if functions is None:
+      functions = self.functions()
+    # keyed by the function objects, as a model keeps their parameters;
+    # functions re-created with the same ids get a new model
+    return self.peakModels.get(tuple(functions), lambda: PeakModel(functions))
+
   def functions(self):
     if self.mode == 'normwin':
       return self.normWindow
@@ -362,40 +601,31 @@ class FitTool(ToolBase):
     self.updateSumCurve()
     self.updateDiffCurve()
 
-  def normalizeXY(self, x, y):
+  def normalizeWindow(self):
     if len(self.normWindow) == 0:
-      yn = np.ones(len(x))
-    else:
-      yn = np.sum([f.y(x) for f in self.normWindow], axis=0)
-      ynmax = max(yn)
-      if ynmax > 0:
-        yn = yn/max(yn)
-    sumy = sum(y*yn)
-    return y/(sum(y) if sumy == 0 else sumy)
+      return None
+    return self.peakModel(self.normWindow)
+
+  def normalizeXY(self, x, y):
+    return normalizeXY(x, y, self.normalizeWindow())
 
   def normalizeLines(self):
     logging.debug('Smooth: %s' % self.smooth.name)
-    for i, (line, curve) in enumerate(zip(self.lines, self.lineCurveItems)):
-      x, y = line.x, line.y
-      if self.bgsub:
-        f = self.bgsub.func(line, None, x)
-        y = y - f(line.x)
-      y = self.normalizeXY(x, y)
-      if i == 0: S = sum(y)
-      y = y/S
-      line.y = y
-      line.y_ = None
-      if self.smooth:
-        y = self.smooth.smooth(x, y)
-      line.y2 = y
-      curve.setXY(line.x, y)
+    values = normalizeLines(self.lines, self.bgsub, self.smooth, self.normalizeWindow())
+    for line, curve, (y, y2) in zip(self.lines, self.lineCurveItems, values):
+      line.setXY(line.x, y, None)
+      line.y2 = y2
+      curve.setXY(line.x, y2)
 
   def updateSumCurve(self):
     if self.sumCurveItem is None:
       return
 
     x = self.sumCurveItem.x
-    y = np.sum([f.y(x) for f in self.functions()], axis=0)
+    y = self.sumCurveItem.y
+    if np.shape(y) != np.shape(x):
+      y = None
+    y = self.peakModel()(x, out=y)
     self.sumCurveItem.setXY(x, y)
 
   def updateDiffCurve(self):
@@ -405,7 +635,7 @@ class FitTool(ToolBase):
 
     x = active.x
     y = active.y
-    diff = np.sum([f.y(x) for f in self.functions()], axis=0) - y
+    diff = self.peakModel()(x) - y
     R2 = 1 - np.sum(diff**2)/np.sum((y - sum(y)/len(y))**2)
     self.R2.setStrValue('%.4f' % R2)
     self.IAD.setStrValue(str(sum(diff)))
@@ -565,8 +795,8 @@ class FitTool(ToolBase):
   def calcPeakPositions(self):
     peakpos = []
     for line in self.lines:
-      x = np.linspace(min(line.x), max(line.y), 500)
-      y = np.sum([f.y(x, self.peakFuncParams.get(line.name)) for f in self.functions()], axis=0)
+      x = np.linspace(min(line.x), max(line.x), 500)
+      y = self.peakModel()(x, self.peakFuncParams.get(line.name))
       mx, my = max(zip(x, y), key=lambda p: p[1])
       peakpos.append((line, (mx, my)))
     self.peakPos = peakpos
@@ -4,7 +4,7 @@ from PyQt5.QtCore import pyqtSignal, Qt
 from PyQt5.QtGui import QKeySequence, QBrush
 from PyQt5.QtWidgets import QVBoxLayout, QHeaderView, QComboBox, \
   QTableWidgetItem, QLabel, QPushButton, QButtonGroup, QWidget, \
-  QCheckBox, QTabWidget
+  QCheckBox, QTabWidget, QSpinBox, QDoubleSpinBox
 
 from functions import blockable
 from toolwidgetbase import *
@@ -400,6 +400,43 @@ class FitToolWidget(ToolWidgetBase):
     hbox.addStretch(1)
     vbox.addLayout(hbox)
 
+    self.globalCombo = QComboBox()
+    for mode, label in self.tool.globalModes:
+      self.globalCombo.addItem(label, mode)
+    self.globalCombo.currentIndexChanged.connect(self.setGlobalMode)
+    self.startCountSpin = QSpinBox()
+    self.startCountSpin.setRange(2, 4096)
+    self.startCountSpin.setValue(self.tool.startCount)
+    self.startCountSpin.valueChanged.connect(self.setGlobalMode)
+    self.setGlobalMode()
+
+    hbox = HBoxLayout()
+    hbox.addWidget(QLabel('Search'))
+    hbox.addWidget(self.globalCombo)
+    hbox.addWidget(QLabel('Starts'))
+    hbox.addWidget(self.startCountSpin)
+    hbox.addStretch(1)
+    vbox.addLayout(hbox)
+
+    self.maxEvaluationsSpin = QSpinBox()
+    self.maxEvaluationsSpin.setRange(0, 10000000)
+    self.maxEvaluationsSpin.setSingleStep(1000)
+    self.maxEvaluationsSpin.setSpecialValueText('No limit')
+    self.maxEvaluationsSpin.valueChanged.connect(self.setOptimizeLimits)
+    self.timeLimitSpin = QDoubleSpinBox()
+    self.timeLimitSpin.setRange(0, 86400)
+    self.timeLimitSpin.setSuffix(' s')
+    self.timeLimitSpin.setSpecialValueText('No limit')
+    self.timeLimitSpin.valueChanged.connect(self.setOptimizeLimits)
+
+    hbox = HBoxLayout()
+    hbox.addWidget(QLabel('Max evaluations'))
+    hbox.addWidget(self.maxEvaluationsSpin)
+    hbox.addWidget(QLabel('Time limit'))
+    hbox.addWidget(self.timeLimitSpin)
+    hbox.addStretch(1)
+    vbox.addLayout(hbox)
+
     hbox = HBoxLayout()
     hbox.addWidget(QLabel('Constraints'))
     hbox.addWidget(self.tool.constraints.getWidget())
@@ -414,14 +451,28 @@ class FitToolWidget(ToolWidgetBase):
     self.optimize1Btn = QPushButton('Optimize')
     self.optimize1Btn.pressed.connect(lambda: self.optimize(1))
     self.optimizeAutoBtn = QPushButton()
-    self.optimizeAutoBtn.pressed.connect(lambda: self.optimize(-1, toggle=True))
+    self.optimizeAutoBtn.pressed.connect(self.optimizeAutoOrCancel)
+    self.optimizeAllBtn = QPushButton('Fit all lines')
+    self.optimizeAllBtn.pressed.connect(self.optimizeAllLines)
+    self.tool.batchProgress.connect(self.batchProgress)
     self.optimizeStatus = QLabel()
     hbox = HBoxLayout()
     hbox.addWidget(self.optimize1Btn)
     hbox.addWidget(self.optimizeAutoBtn)
+    hbox.addWidget(self.optimizeAllBtn)
     hbox.addWidget(self.optimizeStatus)
     hbox.addStretch(1)
     vbox.addLayout(hbox)
+
+    self.continuationCheck = QCheckBox('Fit all lines in order of pressure')
+    self.extrapolateCheck = QCheckBox('Extrapolate start values')
+    self.extrapolateCheck.setEnabled(False)
+    self.continuationCheck.toggled.connect(self.extrapolateCheck.setEnabled)
+    hbox = HBoxLayout()
+    hbox.addWidget(self.continuationCheck)
+    hbox.addWidget(self.extrapolateCheck)
+    hbox.addStretch(1)
+    vbox.addLayout(hbox)
     self.optimizeCnt = 0
     self.optimizeFinished()
 
@@ -491,6 +542,16 @@ class FitToolWidget(ToolWidgetBase):
   def setOptimizeMethod(self):
     self.tool.optimizeMethod = self.optimizeCombo.currentText()
 
+  def setOptimizeLimits(self):
+    self.tool.maxEvaluations = self.maxEvaluationsSpin.value() or None
+    self.tool.timeLimit = self.timeLimitSpin.value() or None
+
+  def setGlobalMode(self):
+    mode = self.globalCombo.currentData()
+    self.tool.globalMode = mode
+    self.tool.startCount = self.startCountSpin.value()
+    self.startCountSpin.setEnabled(mode in ('sobol', 'lhs'))
+
   def clear(self):
     self.lineSelector.clear()
     while self.pressureBox.count() > 0:
@@ -580,9 +641,15 @@ class FitToolWidget(ToolWidgetBase):
     self.setUpdatesEnabled(True)
     self.peakFunctions.setFocus()
 
-  def optimize(self, cnt, toggle=False):
-    if self.optimizeCnt != 0:
-      if toggle: self.optimizeCnt = 0
+  def optimizeAutoOrCancel(self):
+    if self.optimizeCnt != 0 or self.tool.optimizer:
+      self.optimizeCnt = 0
+      self.tool.cancelOptimize()
+      return
+    self.optimize(-1)
+
+  def optimize(self, cnt):
+    if self.optimizeCnt != 0 or self.tool.optimizer:
       return
 
     params = [p for p in self.peakFunctions.selectedParameters() if not p.readOnly]
@@ -608,11 +675,11 @@ class FitToolWidget(ToolWidgetBase):
         prevRes[0] = res
 
       self.optimize1Btn.setEnabled(False)
+      self.optimizeAllBtn.setEnabled(False)
+      self.optimizeAutoBtn.setText('Cancel')
       if self.optimizeCnt < 0:
-        self.optimizeAutoBtn.setText('Cancel')
         self.optimizeStatus.setText('Running... %d' % (-self.optimizeCnt - 1))
       else:
-        self.optimizeAutoBtn.setEnabled(False)
         self.optimizeStatus.setText('Running...')
 
       self.optimizeCnt -= 1
@@ -624,10 +691,38 @@ class FitToolWidget(ToolWidgetBase):
 
     callback(True, [], [])
 
+  def optimizeAllLines(self):
+    if self.optimizeCnt != 0 or self.tool.optimizer:
+      return
+
+    params = [p for p in self.peakFunctions.selectedParameters() if not p.readOnly]
+    if len(params) == 0:
+      raise RuntimeError('Select parameters to optimize')
+
+    def callback(success):
+      self.optimizeFinished()
+      self.plotRequested.emit(self.tool, False)
+
+    self.optimize1Btn.setEnabled(False)
+    self.optimizeAutoBtn.setText('Cancel')
+    self.optimizeAllBtn.setEnabled(False)
+    self.optimizeStatus.setText('Running...')
+    try:
+      self.tool.optimizeAllLines(params, callback,
+                                 self.continuationCheck.isChecked(),
+                                 self.extrapolateCheck.isChecked())
+    except:
+      self.optimizeFinished()
+      raise
+
+  def batchProgress(self, done, total):
+    self.optimizeStatus.setText('Running... %d/%d' % (done, total))
+
   def optimizeFinished(self):
     self.optimize1Btn.setEnabled(True)
     self.optimizeAutoBtn.setText('Auto run')
     self.optimizeAutoBtn.setEnabled(True)
+    self.optimizeAllBtn.setEnabled(True)
     self.optimizeStatus.setText('')
     self.optimizeCnt = 0
 
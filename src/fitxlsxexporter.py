@@ -146,7 +146,7 @@ class FitXlsxExporter(XlsxExporter):
     if len(self.tool.normWindow) == 0:
       win = np.ones(len(x))
     else:
-      win = np.sum([f.y(x) for f in self.tool.normWindow], axis=0)
+      win = self.tool.peakModel(self.tool.normWindow)(x)
     win = win/max(win)*maxy*0.8
     cols = [('x', x), ('window', win)] + [(l.name, l.y) for l in self.lines]
 
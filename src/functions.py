@@ -1,3 +1,8 @@
+from collections import OrderedDict
+import numpy as np
+
+
+
 def getTableColumnLabel(c):
   label = ''
   while True:
@@ -21,6 +26,19 @@ def parseTableColumnLabel(label):
 def getTableCellName(r, c, absx='', absy=''):
   return '%s%s%s%d' % (absx, getTableColumnLabel(c), absy, r+1)
 
+def dataRange(values):
+  # (min, max) ignoring NaN, or None if there are no numbers
+  values = np.asarray(values, dtype=float)
+  if len(values) == 0:
+    return None
+  v1, v2 = np.min(values), np.max(values)
+  if np.isnan(v1):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+      return None
+    v1, v2 = np.min(values), np.max(values)
+  return float(v1), float(v2)
+
 class blockable:
   class functor:
     def __init__(self, blocker, targetobj):
@@ -49,3 +67,38 @@ class blockable:
     if obj not in self.functors:
       self.functors[obj] = self.functor(self, obj)
     return self.functors[obj]
+
+class LRUCache:
+  def __init__(self, maxsize):
+    self.maxsize = maxsize
+    self.items = OrderedDict()
+
+  def __len__(self):
+    return len(self.items)
+
+  def get(self, key, create):
+    if key in self.items:
+      self.items.move_to_end(key)
+      return self.items[key]
+
+    value = create()
+    self.items[key] = value
+    while len(self.items) > self.maxsize:
+      self.items.popitem(last=False)
+    return value
+
+  def clear(self):
+    self.items.clear()
+
+class SettingValues:
+  # Setting values of a method object as strings, as SettingObj stores
+  # them, for the computation shared with the headless batch processor.
+  settingDefaults = {}
+
+  def __init__(self, values=None):
+    self.values = dict(self.settingDefaults)
+    if values:
+      self.values.update(values)
+
+  def strValue(self, name):
+    return self.values[name]
@@ -5,8 +5,12 @@ from PyQt5.QtWidgets import QGraphicsObject
 import pyqtgraph as pg
 import numpy as np
 import struct
+import ctypes
+import weakref
 from OpenGL import GL
 
+from functions import dataRange
+
 
 
 __all__ = ['GraphItemBase', 'PathItem', 'PlotCurveItem']
@@ -17,6 +21,8 @@ class GraphItemBase(QGraphicsObject):
   hoveringChanged = pyqtSignal()
   touchable = False
   label = None
+  # GL buffers of deleted items; freed while the GL context is current
+  releasedGLBuffers = []
 
   def __init__(self, view):
     super().__init__()
@@ -57,9 +63,22 @@ class GraphItemBase(QGraphicsObject):
       GL.glEnable(GL.GL_SCISSOR_TEST)
       GL.glScissor(*map(int, (x, y, w, h)))
 
+      if self.releasedGLBuffers:
+        GL.glDeleteBuffers(len(self.releasedGLBuffers), self.releasedGLBuffers)
+        del self.releasedGLBuffers[:]
+
+      # Qt resets the GL state for each native painting, so the state is
+      # set once here for all the draws of the item
+      GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+      GL.glEnable(GL.GL_LINE_SMOOTH)
+      GL.glHint(GL.GL_LINE_SMOOTH_HINT, GL.GL_NICEST)
+      GL.glEnable(GL.GL_BLEND)
+      GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+
       try:
         self.paintGL()
       finally:
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
         painter.endNativePainting()
     else:
       painter.setRenderHint(QPainter.Antialiasing)
@@ -94,61 +113,187 @@ class GraphItemBase(QGraphicsObject):
       self.hovering = False
     self.hoveringChanged.emit()
 
+  def itemChange(self, change, value):
+    # items are reused across plots; one removed while hovered gets no exit
+    if change == self.ItemSceneHasChanged and self.hovering:
+      self.hovering = False
+      self.hoveringChanged.emit()
+    return super().itemChange(change, value)
+
+  def GL_setColor(self, mode):
+    if mode in (GL.GL_LINES, GL.GL_LINE_STRIP, GL.GL_LINE_LOOP):
+      color = self.pen.color()
+      GL.glLineWidth(self.pen.width())
+    elif mode == GL.GL_TRIANGLE_FAN:
+      color = self.brush.color()
+
+    GL.glColor3f(color.red()/255, color.green()/255, color.blue()/255)
+
   def GL_drawPath(self, x, y, mode=GL.GL_LINE_STRIP):
+    # for shapes changing with the view; see PathItem for static curves
     points = np.empty((len(x), 2))
     points[:,0] = x
     points[:,1] = y
 
-    GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
-    try:
-      GL.glVertexPointerf(points)
-
-      if mode in (GL.GL_LINES, GL.GL_LINE_STRIP, GL.GL_LINE_LOOP):
-        GL.glEnable(GL.GL_LINE_SMOOTH)
-        GL.glHint(GL.GL_LINE_SMOOTH_HINT, GL.GL_NICEST)
-        GL.glEnable(GL.GL_BLEND)
-        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
-
-        color = self.pen.color()
-        GL.glLineWidth(self.pen.width())
-      elif mode == GL.GL_TRIANGLE_FAN:
-        color = self.brush.color()
-
-      GL.glColor3f(color.red()/255, color.green()/255, color.blue()/255)
-
-      GL.glDrawArrays(mode, 0, points.shape[0]);
-    finally:
-      GL.glDisableClientState(GL.GL_VERTEX_ARRAY);
+    GL.glVertexPointerf(points)
+    self.GL_setColor(mode)
+    GL.glDrawArrays(mode, 0, points.shape[0])
 
 
 
 class PathItem(GraphItemBase):
   maxLineWidth = 2
+  # curves of lodMinPoints or more points sorted by x are drawn from the
+  # level of detail matching the view
+  lodMinPoints = 1 << 12
 
   def __init__(self, view, color):
     super().__init__(view)
     self.pen = pg.mkPen(color, width=2)
+    self.lod = None
+    # GL buffers of the vertices and of the indices of the LOD levels;
+    # uploaded on the first paint after setXY
+    self.glBuffers = []
+    self.glDirty = True
+    weakref.finalize(self, self.releasedGLBuffers.extend, self.glBuffers)
 
   def paint_(self, painter):
-    painter.drawPath(self.path)
+    if self.lod is None:
+      painter.drawPath(self.path)
+      return
+
+    key, x, y = self.lodXY()
+    if self.lodPath[0] != key:
+      self.lodPath = key, self.createPath(x, y)
+    painter.drawPath(self.lodPath[1])
 
   def paintGL(self):
-    self.GL_drawPath(self.x, self.y)
+    if self.glDirty:
+      self.GL_upload()
+
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.glBuffers[0])
+    try:
+      GL.glVertexPointer(2, GL.GL_FLOAT, 0, None)
+      self.GL_setColor(GL.GL_LINE_STRIP)
+
+      if self.lod is None:
+        GL.glDrawArrays(GL.GL_LINE_STRIP, 0, len(self.x))
+        return
+
+      k, i1, i2 = self.lodRange()
+      if k == 0:
+        GL.glDrawArrays(GL.GL_LINE_STRIP, int(i1), int(i2 - i1))
+        return
+
+      GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.glBuffers[1])
+      try:
+        offset = 4*(self.glLevelOffsets[k] + int(i1))
+        GL.glDrawElements(GL.GL_LINE_STRIP, int(i2 - i1), GL.GL_UNSIGNED_INT, ctypes.c_void_p(offset))
+      finally:
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+    finally:
+      GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+  def GL_upload(self):
+    # vertices (float32, as glVertexPointerf) and the indices of all the
+    # LOD levels in one buffer
+    self.glDirty = False
+    if not self.glBuffers:
+      self.glBuffers.extend(GL.glGenBuffers(2))
+
+    x, y = (self.x, self.y) if self.lod is None else self.lod[:2]
+    vertices = np.empty((len(x), 2), dtype=np.float32)
+    vertices[:,0] = x
+    vertices[:,1] = y
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.glBuffers[0])
+    GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL.GL_STATIC_DRAW)
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    if self.lod is not None:
+      levels = self.lod[2][1:]
+      self.glLevelOffsets = [None] + [int(n) for n in np.cumsum([0] + [len(l) for l in levels])]
+      indices = np.concatenate(levels).astype(np.uint32)
+      GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.glBuffers[1])
+      GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL.GL_STATIC_DRAW)
+      GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
 
   def setXY(self, x, y):
     self.x = x
     self.y = y
+    self.xRange = dataRange(x)
+    self.yRange = dataRange(y)
+    self.lod = self.createLOD(x, y)
     self.updatePath()
+    self.glDirty = True
 
     self.prepareGeometryChange()
     self.invalidateBoundingRect()
     self.update()
 
   def updatePath(self):
-    self.path = self.createPath(self.x, self.y)
+    if self.lod is None:
+      self.path = self.createPath(self.x, self.y)
+    else:
+      self.path = None
+      self.lodPath = None, None
+
+  @classmethod
+  def createLOD(cls, x, y):
+    # (x, y, levels) where x is ascending and levels[k] holds the indices
+    # of the minimum and the maximum of y in each bucket of 2**k points,
+    # in the order of the points; levels[0] is None for all the points
+    if len(x) < cls.lodMinPoints:
+      return None
+    if np.all(x[1:] >= x[:-1]):
+      pass
+    elif np.all(x[1:] <= x[:-1]):
+      x, y = x[::-1], y[::-1]
+    else:
+      return None
+
+    levels = [None]
+    imin = imax = np.arange(len(y), dtype=np.int32 if len(y) < 1<<31 else np.int64)
+    while len(imin) > cls.lodMinPoints//16:
+      m = len(imin)//2*2
+      a, b = imin[0:m:2], imin[1:m:2]
+      imin_ = np.where(y[b] < y[a], b, a)
+      a, b = imax[0:m:2], imax[1:m:2]
+      imax_ = np.where(y[b] > y[a], b, a)
+      if m < len(imin):
+        imin_, imax_ = np.append(imin_, imin[-1]), np.append(imax_, imax[-1])
+      imin, imax = imin_, imax_
+      levels.append(np.sort(np.stack([imin, imax], 1), 1).ravel())
+    return x, y, levels
+
+  def lodRange(self):
+    # (k, i1, i2); the visible points are x[i1:i2] if k is 0, otherwise
+    # x[levels[k][i1:i2]], at the level where each pixel column has one
+    # bucket or more
+    x, y, levels = self.lod
+    rect = self.view.viewRect()
+    i1, i2 = np.searchsorted(x, [rect.left(), rect.right()])
+    i1, i2 = max(i1 - 1, 0), min(i2 + 1, len(x))
+    pixels = rect.width()/self.view.pixelRatio[0]
+    perPixel = (i2 - i1)/pixels if pixels > 0 else 0
+    k = min(int(np.log2(perPixel)), len(levels) - 1) if perPixel >= 2 else 0
+
+    if k == 0:
+      return 0, i1, i2
+    return k, 2*(i1 >> k), 2*-(-i2 >> k)
+
+  def lodXY(self):
+    # (key, x, y) of the visible points
+    x, y, levels = self.lod
+    key = k, i1, i2 = self.lodRange()
+    if k == 0:
+      return key, x[i1:i2], y[i1:i2]
+    idx = levels[k][i1:i2]
+    return key, x[idx], y[idx]
 
   @classmethod
-  def createPath(cls, x, y, fill=Qt.OddEvenFill):
+  def createPath(cls, x, y, fill=Qt.OddEvenFill, moveTo=None):
+    # moveTo: bool array of the points starting subpaths; only the first
+    # one by default
     # https://code.woboq.org/qt5/qtbase/src/gui/painting/qpainterpath.cpp.html#_ZrsR11QDataStreamR12QPainterPath
     # http://doc.qt.io/qt-5/qpainterpath.html#ElementType-enum
     # http://doc.qt.io/qt-5/qt.html#FillRule-enum
@@ -177,8 +322,9 @@ class PathItem(GraphItemBase):
       return path
 
     data = np.empty(N+2, dtype=[('type', '<i4'), ('x', '<f8'), ('y', '<f8')])
-    data[1]['type'] = 0
-    data[2:N+1]['type'] = 1
+    if moveTo is None:
+      moveTo = np.arange(N) == 0
+    data[1:N+1]['type'] = np.where(moveTo, 0, 1)
     data[1:N+1]['x'] = x
     data[1:N+1]['y'] = y
 
@@ -187,7 +333,8 @@ class PathItem(GraphItemBase):
     view = data.view(dtype=np.ubyte)
     view[:16] = 0
     view.data[16:20] = struct.pack('<i', N)
-    view.data[fpos:fpos+8] = struct.pack('<ii', N-1, int(fill))
+    start = int(np.nonzero(moveTo)[0][-1])
+    view.data[fpos:fpos+8] = struct.pack('<ii', start, int(fill))
 
     buf = QByteArray.fromRawData(view.data[16:fpos+8])
     ds = QDataStream(buf)
@@ -197,28 +344,57 @@ class PathItem(GraphItemBase):
     return path
 
   def dataBounds(self, ax, frac, orthoRange=None):
-    if ax == 0:
-      return min(self.x), max(self.x)
-    else:
-      return min(self.y), max(self.y)
+    return self.xRange if ax == 0 else self.yRange
 
   def boundingRect_(self):
+    if self.xRange is None or self.yRange is None:
+      return QRectF()
     rx, ry = self.view.pixelRatio
-    x1, x2 = min(self.x), max(self.x)
-    y1, y2 = min(self.y), max(self.y)
+    x1, x2 = self.xRange
+    y1, y2 = self.yRange
     mx, my = self.maxLineWidth*rx, self.maxLineWidth*ry
     return QRectF(x1-mx/2, y1-my/2, x2-x1+mx, y2-y1+my)
 
 
 
+class SegmentIndex:
+  # Bounding boxes of the segments of a polyline sorted by their left
+  # edges; the right edges are maximized per block, so that a query
+  # skips the blocks left of it.
+  blockSize = 64
+
+  def __init__(self, x, y):
+    x1, x2 = np.minimum(x[:-1], x[1:]), np.maximum(x[:-1], x[1:])
+    y1, y2 = np.minimum(y[:-1], y[1:]), np.maximum(y[:-1], y[1:])
+    self.order = np.argsort(x1, kind='stable')
+    self.x1, self.x2 = x1[self.order], x2[self.order]
+    self.y1, self.y2 = y1[self.order], y2[self.order]
+    if len(self.order):
+      self.blockX2 = np.maximum.reduceat(self.x2, np.arange(0, len(self.order), self.blockSize))
+    else:
+      self.blockX2 = np.empty(0)
+
+  def query(self, x1, y1, x2, y2):
+    # indices of the segments whose boxes intersect the rect
+    B = self.blockSize
+    end = np.searchsorted(self.x1, x2, 'right')
+    blocks = np.nonzero(self.blockX2[:-(-end // B)] >= x1)[0]
+    idx = (blocks[:,None]*B + np.arange(B)).ravel()
+    idx = idx[idx < end]
+    idx = idx[(self.x2[idx] >= x1) & (self.y1[idx] <= y2) & (self.y2[idx] >= y1)]
+    return self.order[idx]
+
+
+
 class PlotCurveItem(PathItem):
   touchable = True
   maxLineWidth = 4
+  # width of the band around the curve for hovering, in pixels
+  hitWidth = 8
 
   def __init__(self, x, y, view, color, label=None):
     super().__init__(view, color)
     self.label = label
-    self.shapePath = None
     self.setXY(x, y)
     self.setHighlighted(False)
     self.setAcceptHoverEvents(True)
@@ -229,39 +405,68 @@ class PlotCurveItem(PathItem):
 
   def updatePath(self):
     super().updatePath()
+    self.segmentIndex = None
     self.shapePath = None
 
-  def createShapePath(self):
+  def segmentsNear(self, rect):
+    # indices of the segments passing within hitWidth/2 pixels of rect
+    if self.segmentIndex is None:
+      self.segmentIndex = SegmentIndex(self.x, self.y)
+
     rx, ry = self.view.pixelRatio
-    w = 8
-
-    dx = self.x[1:] - self.x[:-1]
-    dy = self.y[1:] - self.y[:-1]
-    theta1 = np.arctan2(dx/rx, -dy/ry)
-    theta2 = theta1 + np.pi
-
-    dxf = np.cos(theta1)*w/2*rx
-    dyf = np.sin(theta1)*w/2*ry
-    dxr = np.cos(theta2)*w/2*rx
-    dyr = np.sin(theta2)*w/2*ry
-
-    xf = np.array([self.x[:-1]+dxf, self.x[1:]+dxf]).flatten('F')
-    yf = np.array([self.y[:-1]+dyf, self.y[1:]+dyf]).flatten('F')
-    xr = np.array([self.x[:-1]+dxr, self.x[1:]+dxr]).flatten('F')
-    yr = np.array([self.y[:-1]+dyr, self.y[1:]+dyr]).flatten('F')
-
-    stroke = self.createPath(
-      np.append(xf, xr[::-1]),
-      np.append(yf, yr[::-1]),
-      Qt.WindingFill
-    )
-    stroke.closeSubpath()
-    return stroke
+    mx, my = self.hitWidth/2*rx, self.hitWidth/2*ry
+    x1, y1, x2, y2 = rect.left() - mx, rect.top() - my, rect.right() + mx, rect.bottom() + my
+    seg = self.segmentIndex.query(x1, y1, x2, y2)
+
+    # clip the segments by the rect (Liang-Barsky)
+    X, Y = self.x[seg], self.y[seg]
+    dx, dy = self.x[seg+1] - X, self.y[seg+1] - Y
+    t0, t1 = np.zeros(len(seg)), np.ones(len(seg))
+    with np.errstate(divide='ignore', invalid='ignore'):
+      for p, q in (-dx, X - x1), (dx, x2 - X), (-dy, Y - y1), (dy, y2 - Y):
+        r = q/p
+        t0 = np.where(p < 0, np.maximum(t0, r), t0)
+        t1 = np.where(p > 0, np.minimum(t1, r), t1)
+        t1 = np.where((p == 0) & (q < 0), -1, t1)
+
+    return seg[t0 <= t1]
+
+  def hitTest(self, rect):
+    return len(self.segmentsNear(rect)) > 0
+
+  def contains(self, point):
+    return self.hitTest(QRectF(point, point))
+
+  def collidesWithPath(self, path, mode=Qt.IntersectsItemShape):
+    return self.hitTest(path.boundingRect())
 
   def shape(self):
-    if not self.shapePath:
-      self.shapePath = self.createShapePath()
-    return self.shapePath
+    # the band around the segments in the view range; cached until the
+    # view range, pixel ratio or data changes
+    rect = self.view.viewRect()
+    key = rect.getRect(), self.view.pixelRatio
+    if self.shapePath is None or self.shapePath[0] != key:
+      self.shapePath = key, self.createShapePath(rect)
+    return self.shapePath[1]
+
+  def createShapePath(self, rect):
+    # one quadrangle per segment, made of 5 points from a moveTo; large
+    # curves use the segments drawn from the level of detail
+    rx, ry = self.view.pixelRatio
+    w = self.hitWidth
+    if self.lod is None:
+      seg = self.segmentsNear(rect)
+      x0, y0, x1, y1 = self.x[seg], self.y[seg], self.x[seg+1], self.y[seg+1]
+    else:
+      key, x, y = self.lodXY()
+      x0, y0, x1, y1 = x[:-1], y[:-1], x[1:], y[1:]
+    theta = np.arctan2((x1 - x0)/rx, -(y1 - y0)/ry)
+    dx, dy = np.cos(theta)*w/2*rx, np.sin(theta)*w/2*ry
+
+    x = np.stack([x0+dx, x1+dx, x1-dx, x0-dx, x0+dx], axis=1).ravel()
+    y = np.stack([y0+dy, y1+dy, y1-dy, y0-dy, y0+dy], axis=1).ravel()
+    moveTo = np.arange(len(x)) % 5 == 0
+    return self.createPath(x, y, Qt.WindingFill, moveTo)
 
   def setHighlighted(self, highlighted):
     self.update()
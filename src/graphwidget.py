@@ -53,6 +53,20 @@ class GraphWidget(pg.PlotWidget):
     # self.legend = self.addLegend(offset=(10, 10))
     self.colorpicker.reset()
 
+  def setItems(self, items):
+    # removes the items not in items and adds the new ones; the items
+    # kept stay in the scene, stacked in the order of items
+    keep = set(items)
+    for item in list(self.plotItem.items):
+      if item not in keep:
+        self.removeItem(item)
+    current = set(self.plotItem.items)
+    for item in items:
+      if item not in current:
+        self.addItem(item)
+    for i in reversed(range(len(items) - 1)):
+      items[i].stackBefore(items[i+1])
+
   def __geometryChanged(self):
     r = self.viewRect()
     s = self.size()
@@ -0,0 +1,218 @@
+import re
+import time
+import json
+import hashlib
+import logging
+import numpy as np
+
+from line import Line
+from functions import LRUCache
+
+
+
+__all__ = ['settingDefaults', 'iadXPattern', 'iadXFromName', 'interpX', 'smoothLines', 'interpLines',
+           'subtractBG', 'prepareLines', 'normalizedLines', 'linesInnerRange', 'calcXoff',
+           'offsetLines', 'iadValues', 'iadErrors', 'IADPipeline']
+
+
+
+# Numeric part of the IAD tool without Qt objects; IADTool and the batch
+# processor both go through these functions.
+
+
+settingDefaults = {
+  'interpdx': '0.01',
+  'threshold': '1e-10'
+}
+
+iadXPattern = r'^([\+\-]?\d*(?:\.\d+)?)'
+
+def iadXFromName(name):
+  m = re.search(iadXPattern, name)
+  try:
+    return float(m.group(1))
+  except (AttributeError, ValueError):
+    return None
+
+
+def interpX(line, dx):
+  X1, X2 = min(line.x), max(line.x)
+  return np.arange(X1, X2, dx)
+
+
+def smoothLines(lines, smooth):
+  return [Line(l.name, l.x, smooth.smooth(l.x, l.y), None) for l in lines]
+
+
+def interpLines(lines, interp, dx):
+  # interpolation functions and the x values they are evaluated at
+  return [interp.func(l.x, l.y) for l in lines], [interpX(l, dx) for l in lines]
+
+
+def subtractBG(lines, linesF, linesX, bgsub):
+  if not bgsub:
+    return linesF
+  logging.info('Subtract bg: %s' % bgsub.label)
+  linesF_ = []
+  for l, f, x in zip(lines, linesF, linesX):
+    fsub = bgsub.func(l, f, x)
+    linesF_.append((lambda f, fsub: (lambda x: f(x)-fsub(x)))(f, fsub))
+  return linesF_
+
+
+def prepareLines(lines, smooth, interp, bgsub, dx):
+  # smoothed lines, interpolation functions (background subtracted) and
+  # the x values the functions are evaluated at
+  lines = smoothLines(lines, smooth)
+  linesF, linesX = interpLines(lines, interp, dx)
+  return lines, subtractBG(lines, linesF, linesX, bgsub), linesX
+
+
+def normalizedLines(lines, linesF, linesX):
+  return [Line(l.name, x, f(x), None).normalize()
+          for l, f, x in zip(lines, linesF, linesX)]
+
+
+def linesInnerRange(lines, xoff):
+  X1 = max([min(l.x+o) for l, o in zip(lines, xoff) if len(l.x) >= 1])
+  X2 = min([max(l.x+o) for l, o in zip(lines, xoff) if len(l.x) >= 1])
+  return X1, X2
+
+
+def calcXoff(lines, linesF, base, dx, threshold, maxiter=100):
+  # Shifts all lines at once so that their weight centers on the common
+  # x range match that of the base line; returns (xoff, X1, X2).
+  t = time.time()
+  n = len(lines)
+  if n == 1:
+    return [0], min(lines[0].x), max(lines[0].x)
+
+  base = range(n)[base]
+  valid = np.array([len(l.x) >= 1 for l in lines])
+  xmin = np.array([min(l.x) if v else np.nan for l, v in zip(lines, valid)])
+  xmax = np.array([max(l.x) if v else np.nan for l, v in zip(lines, valid)])
+  xoff = np.zeros(n)
+  Y = None
+
+  for it in range(1, maxiter + 1):
+    X1, X2 = np.max((xmin + xoff)[valid]), np.min((xmax + xoff)[valid])
+    x = np.arange(X1, X2, dx)
+    if len(x) == 0:
+      raise RuntimeError('Lines have no common x range')
+
+    if Y is None or Y.shape[1] != len(x):
+      Y = np.empty((n, len(x)))
+    for i, (f, o) in enumerate(zip(linesF, xoff)):
+      Y[i] = f(x - o)
+    wc = Y.dot(x)/Y.sum(axis=1)
+
+    delta = wc[base] - wc
+    delta[base] = 0
+    xoff += delta
+    if np.max(np.abs(delta)) < threshold:
+      break
+
+  else:
+    raise RuntimeError('Maximum loop count exceeded')
+
+  X1, X2 = np.max((xmin + xoff)[valid]), np.min((xmax + xoff)[valid])
+  logging.info('X offset: %d iterations, %.3fs' % (it, time.time() - t))
+  return list(xoff), X1, X2
+
+
+def offsetLines(lines, linesF, base, dx, threshold):
+  # lines shifted onto the weight center of the base line and
+  # normalized on their common x range
+  xoff, X1, X2 = calcXoff(lines, linesF, base, dx, threshold)
+  x = np.arange(X1, X2, dx)
+  lines_off = []
+  for l, f, o in zip(lines, linesF, xoff):
+    y = f(x-o)
+    lines_off.append(Line(l.name, x, y, None).normalize())
+  return lines_off, xoff
+
+
+def iadValues(lines_off, base):
+  diff = [l - lines_off[base] for l in lines_off]
+  return diff, [np.sum(np.abs(d.y)) for d in diff]
+
+
+def iadErrors(lines, base):
+  # 誤差計算
+  # スプライン補完で点を増やしてnormalizeしてから誤差を出すと
+  # 二乗和なので誤差が小さくなってしまう(測定点の水増し)
+  lnorm = [l.normalize() for l in lines]
+  return [np.sqrt(np.sum(l.y_**2) + np.sum(lnorm[base].y_**2)) for l in lnorm]
+
+
+
+class IADPipeline:
+  # The IAD calculation as stages, smooth -> interpolate -> bgsub ->
+  # normalize / align -> diff, IAD.  Each stage result is memoized on the
+  # key of its input stage and its own settings, so e.g. switching the
+  # plot mode or the base line reuses the smoothed and interpolated lines.
+  def __init__(self, maxsize=32):
+    self.cache = LRUCache(maxsize)
+    self.setInputs([], None, None, None, None, None, -1)
+
+  @classmethod
+  def lineDigest(cls, line):
+    h = hashlib.sha1(line.name.encode())
+    for a in line.x, line.y, line.y_:
+      if a is not None:
+        h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+      h.update(b'|')
+    return h.hexdigest()
+
+  @classmethod
+  def methodKey(cls, obj):
+    if obj is None:
+      return None
+    return obj.name, json.dumps(obj.saveState(), sort_keys=True)
+
+  def setInputs(self, lines, smooth, interp, bgsub, dx, threshold, base):
+    self.lines = lines
+    self.smooth, self.interp, self.bgsub = smooth, interp, bgsub
+    self.dx, self.threshold = dx, threshold
+    self.base = range(len(lines))[base] if lines else base
+
+    self.keys = {}
+    self.keys['lines'] = tuple(self.lineDigest(l) for l in lines)
+    self.keys['smooth'] = self.keys['lines'], self.methodKey(smooth)
+    self.keys['interp'] = self.keys['smooth'], self.methodKey(interp), dx
+    self.keys['bgsub'] = self.keys['interp'], self.methodKey(bgsub)
+    self.keys['norm'] = self.keys['bgsub'],
+    self.keys['align'] = self.keys['bgsub'], self.base, threshold
+    self.keys['iad'] = self.keys['align'],
+    self.keys['errors'] = self.keys['lines'], self.base
+
+  def stage(self, name, create):
+    return self.cache.get((name, self.keys[name]), create)
+
+  def smoothed(self):
+    return self.stage('smooth', lambda: smoothLines(self.lines, self.smooth))
+
+  def interpolated(self):
+    return self.stage('interp', lambda: interpLines(self.smoothed(), self.interp, self.dx))
+
+  def prepared(self):
+    def create():
+      lines = self.smoothed()
+      linesF, linesX = self.interpolated()
+      return lines, subtractBG(lines, linesF, linesX, self.bgsub), linesX
+    return self.stage('bgsub', create)
+
+  def normalized(self):
+    return self.stage('norm', lambda: normalizedLines(*self.prepared()))
+
+  def aligned(self):
+    def create():
+      lines, linesF, linesX = self.prepared()
+      return offsetLines(lines, linesF, self.base, self.dx, self.threshold)
+    return self.stage('align', create)
+
+  def iad(self):
+    return self.stage('iad', lambda: iadValues(self.aligned()[0], self.base))
+
+  def errors(self):
+    return self.stage('errors', lambda: iadErrors(self.lines, self.base))
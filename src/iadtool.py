@@ -5,6 +5,7 @@ from PyQt5.QtCore import QObject, pyqtSignal
 from toolbase import ToolBase
 from settingitems import *
 from line import Line
+from iadcore import *
 
 
 
@@ -24,50 +25,15 @@ class IADTool(ToolBase):
     self.smooth = None
     self.interp = None
     self.lines = None
+    self.pipeline = IADPipeline()
 
     self.addSettingItem(SettingItemFloat(
-      'interpdx', 'dx', '0.01', min_=0))
+      'interpdx', 'dx', settingDefaults['interpdx'], min_=0))
     self.addSettingItem(SettingItemFloat(
-      'threshold', 'Threshold', '1e-10', min_=0))
+      'threshold', 'Threshold', settingDefaults['threshold'], min_=0))
 
-  def calcXoff(self, lines, linesF, baseF):
-    if len(lines) == 1:
-      return [0], min(lines[0].x), max(lines[0].x)
-
-    def weightCenter(x, y):
-      return np.sum(x*y)/np.sum(y)
-
-    xoff = [0] * len(lines)
-
-    for _p in range(len(lines)*10):
-      X1_, X2_ = self.linesInnerRange(lines, xoff)
-      if X1_ == X2_: break
-
-      for i, (line, lineF) in enumerate(zip(lines, linesF)):
-        if lineF == baseF:
-          continue
-
-        cnt = 0
-        while True:
-          X1, X2 = self.linesInnerRange(lines, xoff)
-          x = np.arange(X1, X2, self.interpdx.value())
-          wc1 = weightCenter(x, baseF(x))
-          wc2 = weightCenter(x, lineF(x-xoff[i]))
-
-          dx = wc1 - wc2
-          cnt += 1
-          if abs(dx) < self.threshold.value() or cnt > 10:
-            break
-
-          xoff[i] += dx
-
-      if X1 == X1_ and X2 == X2_:
-        break
-
-    else:
-      raise RuntimeError('Maximum loop count exceeded')
-
-    return xoff, X1, X2
+  def calcXoff(self, lines, linesF, base):
+    return calcXoff(lines, linesF, base, self.interpdx.value(), self.threshold.value())
 
   def updatePeaks(self, lines):
     self.peaks = [l.peak() for l in lines]
@@ -75,13 +41,10 @@ class IADTool(ToolBase):
     return lines
 
   def linesInnerRange(self, lines, xoff):
-    X1 = max([min(l.x+o) for l, o in zip(lines, xoff) if len(l.x) >= 1])
-    X2 = min([max(l.x+o) for l, o in zip(lines, xoff) if len(l.x) >= 1])
-    return X1, X2
+    return linesInnerRange(lines, xoff)
 
   def interpX(self, line):
-    X1, X2 = min(line.x), max(line.x)
-    return np.arange(X1, X2, self.interpdx.value())
+    return interpX(line, self.interpdx.value())
 
   def getLines(self, mode=None):
     if not self.lines:
@@ -93,54 +56,26 @@ class IADTool(ToolBase):
     if mode == 'orig':
       return self.updatePeaks(self.lines)
 
-    lines = [Line(l.name, l.x, self.smooth.smooth(l.x, l.y), None) for l in self.lines]
-    linesF = [self.interp.func(l.x, l.y) for l in lines]
-    linesX = [self.interpX(l) for l in lines]
-    if self.bgsub:
-      logging.info('Subtract bg: %s' % self.bgsub.label)
-      linesF_ = []
-      for l, f, x in zip(lines, linesF, linesX):
-        fsub = self.bgsub.func(l, f, x)
-        linesF_.append((lambda f, fsub: (lambda x: f(x)-fsub(x)))(f, fsub))
-      linesF = linesF_
+    if not -len(self.lines) <= self.base < len(self.lines):
+      self.base = -1
 
+    dx, threshold = self.interpdx.value(), self.threshold.value()
+    self.pipeline.setInputs(
+      self.lines, self.smooth, self.interp, self.bgsub, dx, threshold, self.base)
 
     if mode == 'norm':
-      return self.updatePeaks([Line(l.name, x, f(x), None).normalize()
-                               for l, f, x in zip(lines, linesF, linesX)])
-
-
-    try:
-      baseF = linesF[self.base]
-    except IndexError:
-      baseF = linesF[-1]
-      self.base = -1
+      return self.updatePeaks(self.pipeline.normalized())
 
 
-    self.xoff, X1, X2 = self.calcXoff(lines, linesF, baseF)
-    x = np.arange(X1, X2, self.interpdx.value())
-    lines_off = []
-    for l, f, xoff in zip(lines, linesF, self.xoff):
-      y = f(x-xoff)
-      lines_off.append(Line(l.name, x, y, None).normalize())
+    lines_off, self.xoff = self.pipeline.aligned()
 
     self.wc = [l.weightCenter() for l in lines_off]
     self.xoffUpdated.emit()
 
 
-    diff = [l - lines_off[self.base] for l in lines_off]
-
+    diff, y = self.pipeline.iad()
     x = self.iadX
-    y = [np.sum(np.abs(d.y)) for d in diff]
-
-
-    # 誤差計算
-    # スプライン補完で点を増やしてnormalizeしてから誤差を出すと
-    # 二乗和なので誤差が小さくなってしまう(測定点の水増し)
-    y_ = []
-    lnorm = [l.normalize() for l in self.lines]
-    for l in lnorm:
-      y_.append(np.sqrt(np.sum(l.y_**2) + np.sum(lnorm[self.base].y_**2)))
+    y_ = self.pipeline.errors()
 
 
     self.iadY = y
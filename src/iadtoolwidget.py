@@ -5,6 +5,7 @@ from PyQt5.QtWidgets import QPushButton, QComboBox, QLabel, \
   QTableWidgetItem
 
 from iadtool import IADTool
+from iadcore import iadXPattern
 from toolwidgetbase import *
 from commonwidgets import *
 
@@ -308,7 +309,7 @@ class IADToolWidget(ToolWidgetBase):
     self.linesTable.setRowCount(r + 1)
     self.linesTable.setCellWidget(r, 0, radio)
 
-    m = re.search(r'^([\+\-]?\d*(?:\.\d+)?)', line.name)
+    m = re.search(iadXPattern, line.name)
     if m: self.setIADx(r, m.group(1))
 
     idx = len(self.selectBaseGroup.buttons())
@@ -1,31 +1,17 @@
-import numpy as np
-
 from settingobj import SettingObj
 from settingitems import *
 from commonwidgets import *
+import interpolationcore
 
 
 
 __all__ = ['InterpLinear', 'InterpBSpline',
            'InterpCubicSpline', 'InterpBarycentric',
-           'InterpKrogh', 'InterpPchip', 'InterpAkima']
-
-
-
-class InterpBase(SettingObj):
-  def func(self, x, y):
-    raise NotImplementedError()
-
+           'InterpKrogh', 'InterpPchip', 'InterpAkima', 'interpMethods']
 
 
-class InterpLinear(InterpBase):
-  name = 'linear'
-  label = 'Linear'
-
-  def func(self, x, y):
-    from scipy.interpolate import interp1d
-    return interp1d(x, y, 'linear')
 
+class InterpLinear(SettingObj, interpolationcore.InterpLinear):
   def descriptionWidget(self):
     w = DescriptionWidget()
     w.addTitle(self.label)
@@ -38,39 +24,14 @@ This runs <code>scipy.interpolate.interp1d(x, y, "linear")</code>.<br>
 
 
 
-class InterpBSpline(InterpBase):
-  name = 'b_spline'
-  label = 'B-spline'
-
+class InterpBSpline(SettingObj, interpolationcore.InterpBSpline):
   def __init__(self):
     super().__init__()
-    self.addSettingItem(SettingItemStr('w', 'Weight (function of x,y)', '1/(ymax*0.003*(1.00001-y/ymax))'))
-
-  def func(self, x, y):
-    from sympy import sympify, lambdify
-    from scipy.interpolate import splrep, splev
-    w = lambdify(['x', 'y', 'ymax'], sympify(self.w.strValue()), 'numpy')(x, y, np.full(len(x), max(y)))
-    try:
-      iter(w)
-    except:
-      w = np.full(x.shape, w)
-
-    c = len(x)//10
-    xl = np.linspace(x[0]+(x[0]-x[1])*c, x[0], c, endpoint=False)
-    xr = np.flip(np.linspace(x[-1]+(x[-1]-x[-2])*c, x[-1], c, endpoint=False), 0)
-    x2 = np.concatenate((xl, x, xr))
-    y2 = np.concatenate((np.full(c, y[0]), y, np.full(c, y[-1])))
-    w2 = np.concatenate((np.full(c, w[0]), w, np.full(c, w[-1])))
-    spl = splrep(x2, y2, w=w2)
-    return lambda x: splev(x, spl)
+    self.addSettingItem(SettingItemStr('w', 'Weight (function of x,y)', self.settingDefaults['w']))
 
 
 
-class InterpScipy(InterpBase):
-  def func(self, x, y):
-    import scipy.interpolate as interp
-    return getattr(interp, self.clsname)(x, y)
-
+class InterpScipy(SettingObj):
   def descriptionWidget(self):
     modname = 'scipy.interpolate.%s' % self.clsname
     w = DescriptionWidget()
@@ -82,27 +43,22 @@ This uses <code>{0}</code>.<br>
 '''.format(modname, url).strip(), richtext=True)
     return w
 
-class InterpCubicSpline(InterpScipy):
-  name    = 'cubic_spline'
-  label   = 'Cubic spline'
-  clsname = 'CubicSpline'
-
-class InterpBarycentric(InterpScipy):
-  name    = 'barycentric'
-  label   = 'Barycentric'
-  clsname = 'BarycentricInterpolator'
-
-class InterpKrogh(InterpScipy):
-  name    = 'krogh'
-  label   = 'Krogh'
-  clsname = 'KroghInterpolator'
-
-class InterpPchip(InterpScipy):
-  name    = 'pchip'
-  label   = 'Pchip'
-  clsname = 'PchipInterpolator'
-
-class InterpAkima(InterpScipy):
-  name    = 'akima'
-  label   = 'Akima'
-  clsname = 'Akima1DInterpolator'
+class InterpCubicSpline(InterpScipy, interpolationcore.InterpCubicSpline):
+  pass
+
+class InterpBarycentric(InterpScipy, interpolationcore.InterpBarycentric):
+  pass
+
+class InterpKrogh(InterpScipy, interpolationcore.InterpKrogh):
+  pass
+
+class InterpPchip(InterpScipy, interpolationcore.InterpPchip):
+  pass
+
+class InterpAkima(InterpScipy, interpolationcore.InterpAkima):
+  pass
+
+
+
+interpMethods = [InterpCubicSpline, InterpBSpline, InterpLinear, InterpPchip,
+                 InterpAkima, InterpKrogh, InterpBarycentric]
@@ -1,15 +1,22 @@
 import numpy as np
 import pyqtgraph as pg
 
+from functions import dataRange
+
 
 
 class Line:
   def __init__(self, name, x, y, y_):
     self.name = name
+    self.setXY(x, y, y_)
+    self.plotErrors = False
+
+  def setXY(self, x, y, y_):
     self.x = np.array(x)
     self.y = np.array(y)
     self.y_ = None if y_ is None else np.array(y_)
-    self.plotErrors = False
+    # data ranges by axis, computed on demand; None is a valid range
+    self.ranges_ = {}
 
   def copy(self):
     l = Line(self.name, self.x, self.y, self.y_)
@@ -17,24 +24,27 @@ class Line:
     return l
 
   @classmethod
-  def cleanUp(cls, x, y, y_):
-    X, Y, Y_ = [], [], []
-    for xi, yi, yi_ in zip(x, y, y_):
+  def toFloat(cls, values):
+    try:
+      return np.asarray(values, dtype=float)
+    except (ValueError, TypeError):
+      pass
+
+    def f(v):
       try:
-        xi = float(xi)
-        yi = float(yi)
-        yi_ = float(yi_)
+        return float(v)
       except (ValueError, TypeError):
-        continue
-
-      if True in np.isnan([xi, yi, yi_]):
-        continue
-
-      X.append(xi)
-      Y.append(yi)
-      Y_.append(yi_)
+        return np.nan
+    return np.array([f(v) for v in values], dtype=float)
 
-    return np.array(X), np.array(Y), np.array(Y_)
+  @classmethod
+  def cleanUp(cls, x, y, y_):
+    # drops points having a non-numeric or NaN value
+    x, y, y_ = map(cls.toFloat, (x, y, y_))
+    n = min(len(x), len(y), len(y_))
+    x, y, y_ = x[:n], y[:n], y_[:n]
+    mask = ~(np.isnan(x) | np.isnan(y) | np.isnan(y_))
+    return x[mask], y[mask], y_[mask]
 
   def weightCenter(self):
     if len(self.x) == 0: return 0
@@ -72,7 +82,12 @@ class Line:
     return max(zip(self.x, self.y), key=lambda p: p[1])
 
   def getXrange(self):
-    return min(self.x), max(self.x)
+    # None if the line has no points
+    if 'x' not in self.ranges_:
+      self.ranges_['x'] = dataRange(self.x)
+    return self.ranges_['x']
 
   def getYrange(self):
-    return min(self.y), max(self.y)
+    if 'y' not in self.ranges_:
+      self.ranges_['y'] = dataRange(self.y)
+    return self.ranges_['y']
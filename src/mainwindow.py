@@ -7,7 +7,7 @@ from PyQt5.QtCore import Qt, QRectF
 from PyQt5.QtGui import QTextCursor, QKeySequence
 from PyQt5.QtWidgets import \
   QMainWindow, QTextEdit, QDockWidget, \
-  QMenuBar, QMenu, QAction
+  QMenuBar, QMenu, QAction, QProgressDialog
 
 
 import log
@@ -19,6 +19,8 @@ from iadtoolwidget import IADToolWidget
 from fittoolwidget import FitToolWidget
 from configfilemanager import ConfigFileManager
 from sessionfilemanager import SessionFileManager
+from sourcegraph import *
+from fileimport import *
 
 
 
@@ -110,7 +112,9 @@ class MainWindow(QMainWindow):
     self.resize(1000, 800)
     self.setAcceptDrops(True)
 
-    self._prevSheetSet = None
+    self.sheetNodes = {}
+    self.linesNode = LinesNode()
+    self.importers = []
     self.sessionFilename = None
     self.performanceReport = False
 
@@ -147,14 +151,42 @@ class MainWindow(QMainWindow):
       self.importFiles([os.path.realpath(f) for f in dlg.selectedFiles()])
 
   def importFiles(self, filenames):
-    for filename in filenames:
+    # files are parsed in the background; the graph is updated when all
+    # running imports have finished
+    importer = ImportThread(filenames)
+    progress = QProgressDialog('Importing files...', 'Cancel', 0, len(filenames), self)
+    progress.setMinimumDuration(500)
+    progress.canceled.connect(importer.cancel)
+
+    def loaded(filename, ex):
+      progress.setValue(progress.value() + 1)
+      self.fileImported(filename, ex)
+
+    importer.loaded.connect(loaded)
+    importer.finished.connect(lambda: self.importFinished(importer, progress))
+    self.importers.append(importer)
+    importer.start()
+
+  def fileImported(self, filename, ex):
+    if ex is None:
       try:
         f = fileloader.load(filename)
-      except fileloader.UnsupportedFileException as ex:
-        logging.error('Unsupported file: %s %s' % (ex.mimetype, ex.filename))
-        continue
+      except Exception as ex_:
+        ex = ex_
+
+    if isinstance(ex, fileloader.UnsupportedFileException):
+      logging.error('Unsupported file: %s %s' % (ex.mimetype, ex.filename))
+    elif ex is not None:
+      logging.error('Failed to import %s: %s' % (filename, ex))
+    else:
       self.addFile(filename, True, True, [(s, True) for s in f])
 
+  def importFinished(self, importer, progress):
+    progress.reset()
+    self.importers.remove(importer)
+    if self.importers:
+      return
+
     if self.curTool == self.toolIAD:
       self.toolIAD.mode = 'orig'
 
@@ -165,6 +197,9 @@ class MainWindow(QMainWindow):
     self.sourcesWidget.addFile(filename, checked, expanded, sheets)
 
   def update(self, autoRange=True):
+    if self.importers:
+      return
+
     if not self.performanceReport:
       self.update_(autoRange)
 
@@ -184,21 +219,30 @@ class MainWindow(QMainWindow):
 
 
   def update_(self, autoRange=True):
+    # only the sheets whose settings changed are evaluated again; tools
+    # whose lines did not change keep them
+    sheetNodes = {}
+    for f in self.sourcesWidget.files():
+      for sw, c in f['sheets']:
+        node = self.sheetNodes.get(sw.sheet)
+        sheetNodes[sw.sheet] = node or SheetNode(sw.sheet)
+    for sheet, node in self.sheetNodes.items():
+      if sheet not in sheetNodes:
+        node.release()
+    self.sheetNodes = sheetNodes
+
+    # the cell data of disabled sheets is freed unless they are shown
+    enabled = self.sourcesWidget.enabledSheetWidgets()
+    sheets = [sheetNodes[sw.sheet] for sw in enabled]
+    for f in self.sourcesWidget.files():
+      for sw, c in f['sheets']:
+        if sw not in enabled and not sw.isVisible():
+          sheetNodes[sw.sheet].free()
+    self.linesNode.setSheets(sheets)
+    lines = self.linesNode.value()
     for t in self.tools:
-      t.clear()
-
-    for sw in self.sourcesWidget.enabledSheetWidgets():
-      X = sw.sheet.xValues()
-      Y = sw.sheet.yValues()
-      Y_ = sw.sheet.yErrors()
-      if len(X) == 1: X = list(X) * len(Y)
-      if len(X) != len(Y): raise RuntimeError('X and Y formulae count mismatch')
-
-      for i, (x, y, y_) in enumerate(zip(X, Y, Y_)):
-        name = sw.sheet.name
-        if len(Y) > 1: name += ':%s' % i
-        for t in self.tools:
-          t.add(name, x, y, y_)
+      if t.setLines(lines):
+        logging.info('Lines updated: %s' % t.name)
 
     self.updateGraph()
     if autoRange:
@@ -206,27 +250,12 @@ class MainWindow(QMainWindow):
 
   def plotRequested(self, tool, autoRange):
     self.curTool = tool
-
-    sheetSet = [([sw.sheet.xFormula.value(),
-                  sw.sheet.yFormula.value(),
-                  sw.sheet.xRange.strValue()] +
-                 sw.sheet.errors)
-                for sw in self.sourcesWidget.enabledSheetWidgets()]
-    if sheetSet != self._prevSheetSet:
-      logging.info('Force reload lines from sources')
-      self._prevSheetSet = sheetSet
-      self.update()
-      return
-
-    self.updateGraph()
-    if autoRange:
-      self.graphWidget.autoRange()
+    self.update(autoRange)
 
   def updateGraph(self):
-    self.graphWidget.clearItems()
     colorpicker = self.graphWidget.getColorPicker()
-    for item in self.curTool.getGraphItems(colorpicker):
-      self.graphWidget.addItem(item)
+    colorpicker.reset()
+    self.graphWidget.setItems(self.curTool.getGraphItems(colorpicker))
 
   def log_(self, html, activate=False):
     self.logTextEdit.moveCursor(QTextCursor.End)
@@ -237,6 +266,9 @@ class MainWindow(QMainWindow):
       self.logDockWidget.raise_()
 
   def closeEvent(self, ev):
+    for importer in list(self.importers):
+      importer.cancel()
+      importer.wait()
     self.saveConfig()
     ev.accept()
 
@@ -302,7 +334,7 @@ class MainWindow(QMainWindow):
           if 'xformula' in s: sheet.xFormula.setStrValue(s['xformula'])
           if 'yformula' in s: sheet.yFormula.setStrValue(s['yformula'])
           if 'xrange' in s: sheet.xRange.setStrValue(s['xrange'])
-          if 'errors' in s: sheet.errors = s['errors']
+          if s.get('errors'): sheet.setErrors(s['errors'])
           sheets.append((sheet, c))
 
         logging.debug('Add file: %s' % filename)
@@ -343,14 +375,20 @@ class MainWindow(QMainWindow):
         f['filename'] = os.path.relpath(
           f['filename'], os.path.dirname(self.sessionFilename))
 
-      f['sheets'] = [{
-        'enabled': sc,
-        'index': sw.sheet.idx,
-        'xformula': sw.sheet.xFormula.strValue(),
-        'yformula': sw.sheet.yFormula.strValue(),
-        'xrange': sw.sheet.xRange.strValue(),
-        'errors': sw.sheet.errors
-      } for sw, sc in f['sheets']]
+      sheets = []
+      for sw, sc in f['sheets']:
+        sheet = {
+          'enabled': sc,
+          'index': sw.sheet.idx,
+          'xformula': sw.sheet.xFormula.strValue(),
+          'yformula': sw.sheet.yFormula.strValue(),
+          'xrange': sw.sheet.xRange.strValue()
+        }
+        # errors_ is None while the default errors are used
+        if sw.sheet.errors_ is not None:
+          sheet['errors'] = sw.sheet.errors_
+        sheets.append(sheet)
+      f['sheets'] = sheets
 
       files.append(f)
 
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import tempfile
+import logging
+import numpy as np
+
+
+
+__all__ = ['ParseCache']
+
+
+
+class ParseCache:
+  # Parsed data of source files keyed by the path, size, mtime and content
+  # hash of the file.  Each part of a file (the list of its sheets, the
+  # cells of a sheet) is stored in its own .npz, so that parts are read
+  # and written only when needed.  The least recently used entries are
+  # removed when the total size exceeds maxBytes.
+  version = 2
+  maxBytes = 512 << 20
+  instance = None
+
+  def __init__(self, dirpath=None, maxBytes=None):
+    if dirpath is None:
+      import appdirs
+      dirpath = os.path.join(appdirs.user_config_dir('tuna'), 'cache')
+    self.dirpath = dirpath
+    if maxBytes is not None:
+      self.maxBytes = maxBytes
+    self.hashes = {}
+
+  @classmethod
+  def get(cls):
+    if cls.instance is None:
+      cls.instance = cls()
+    return cls.instance
+
+  @classmethod
+  def contentHash(cls, filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+      while True:
+        buf = f.read(1 << 20)
+        if not buf:
+          break
+        h.update(buf)
+    return h.hexdigest()
+
+  def fileHash(self, filename):
+    # (stat, content hash) of the file; memoized by its path, size and mtime
+    filename = os.path.realpath(filename)
+    st = os.stat(filename)
+    stat = filename, st.st_size, st.st_mtime_ns
+    if stat not in self.hashes:
+      self.hashes[stat] = self.contentHash(filename)
+    return stat, self.hashes[stat]
+
+  def addFileHash(self, stat, hash):
+    # a fileHash computed by another process
+    self.hashes[tuple(stat)] = hash
+
+  def key(self, fileHash, part):
+    # fileHash: fileHash() of the file, computed once by the caller
+    stat, hash = fileHash
+    text = json.dumps([self.version, part] + list(stat) + [hash])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+  def path(self, key):
+    return os.path.join(self.dirpath, '%s.npz' % key)
+
+  def contains(self, fileHash, part):
+    return os.path.exists(self.path(self.key(fileHash, part)))
+
+  def load(self, fileHash, part):
+    # returns (meta, arrays) or None
+    filename = fileHash[0][0]
+    try:
+      path = self.path(self.key(fileHash, part))
+      if not os.path.exists(path):
+        return None
+
+      with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        arrays = {k: data[k] for k in data.files if k != 'meta'}
+      os.utime(path)
+    except Exception as ex:
+      logging.warning('Failed to load parse cache of %s: %s' % (filename, ex))
+      return None
+
+    logging.debug('Load from parse cache: %s %s' % (filename, part))
+    return meta, arrays
+
+  def save(self, fileHash, part, meta, arrays):
+    # meta: JSON serializable, arrays: {name: numpy array}
+    filename = fileHash[0][0]
+    tmp = None
+    try:
+      os.makedirs(self.dirpath, exist_ok=True)
+      path = self.path(self.key(fileHash, part))
+      # unique per thread, as the import pool may save the same part twice
+      with tempfile.NamedTemporaryFile(dir=self.dirpath, suffix='.tmp', delete=False) as f:
+        tmp = f.name
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+      os.replace(tmp, path)
+    except Exception as ex:
+      logging.warning('Failed to save parse cache of %s: %s' % (filename, ex))
+      if tmp and os.path.exists(tmp):
+        os.remove(tmp)
+      return
+
+    self.evict()
+
+  def entries(self):
+    entries = []
+    for name in os.listdir(self.dirpath):
+      if name.endswith('.npz'):
+        path = os.path.join(self.dirpath, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        entries.append((st.st_atime, st.st_size, path))
+    return sorted(entries)
+
+  def evict(self):
+    entries = self.entries()
+    total = sum(size for t, size, path in entries)
+    for t, size, path in entries:
+      if total <= self.maxBytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+      logging.debug('Evict parse cache: %s' % path)
+
+  def clear(self):
+    for t, size, path in self.entries():
+      os.remove(path)
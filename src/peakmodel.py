@@ -0,0 +1,76 @@
+import numpy as np
+
+
+
+__all__ = ['PeakModel']
+
+
+
+class PeakModel:
+  # Sum of fit functions evaluated group by group: functions of the same
+  # class share one compiled expression, which is called once with the
+  # parameters of the whole group broadcast against x.
+  def __init__(self, functions):
+    self.functions = list(functions)
+
+    groups = {}
+    for func in self.functions:
+      groups.setdefault(func.__class__, []).append(func)
+
+    # parameter values of all functions in one contiguous array;
+    # each group is laid out as (argument, function)
+    self.params = []
+    layout = []
+    for cls, funcs in groups.items():
+      args = cls.exprArgs()
+      offset = len(self.params)
+      for a in args:
+        self.params += [f.paramsNameMap[a] for f in funcs]
+      layout.append((cls.compile(args), offset, len(args), len(funcs)))
+
+    self.values = np.empty(len(self.params))
+    self.groups = []
+    for func, offset, nargs, nfuncs in layout:
+      values = self.values[offset:offset + nargs*nfuncs].reshape(nargs, nfuncs, 1)
+      self.groups.append((func, values))
+
+    self.__buffers = {}
+
+  def loadValues(self, funcParams=None):
+    # funcParams: {function id: {parameter name: value}}, e.g. the saved
+    # parameters of a line; missing entries use the current values
+    if funcParams:
+      def value(p):
+        values = funcParams.get(p.func.id)
+        if values and p.name in values:
+          return values[p.name]
+        return p.value()
+      self.values[:] = [value(p) for p in self.params]
+    else:
+      self.values[:] = [p.value() for p in self.params]
+
+  def buffer(self, shape):
+    if shape not in self.__buffers:
+      self.__buffers[shape] = np.empty(shape)
+    return self.__buffers[shape]
+
+  def evaluate(self, x, funcParams=None, out=None):
+    x = np.asarray(x, dtype=float)
+    if out is None:
+      out = np.empty(x.shape)
+
+    out[:] = 0
+    if not self.groups:
+      return out
+
+    self.loadValues(funcParams)
+    x_ = x.reshape((1,) + x.shape)
+    for func, values in self.groups:
+      y = func(x_, *values)
+      shape = (values.shape[1],) + x.shape
+      if np.shape(y) != shape:
+        y = np.broadcast_to(y, shape)
+      out += np.sum(y, axis=0, out=self.buffer(x.shape))
+    return out
+
+  __call__ = evaluate
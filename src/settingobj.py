@@ -25,6 +25,9 @@ class SettingObj:
     self.__itemsMap[item.name] = item
     setattr(self, item.name, item)
 
+  def strValue(self, name):
+    return self.__itemsMap[name].strValue()
+
   def getSettingWidget(self):
     if self.__widget is None:
       self.__widget = self.createSettingWidget()
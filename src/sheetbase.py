@@ -9,7 +9,7 @@ from settingitems import *
 
 class UnsupportedFileException(Exception):
   def __init__(self, filename, mimetype):
-    super().__init__()
+    super().__init__(filename, mimetype)
     self.filename = filename
     self.mimetype = mimetype
 
@@ -23,32 +23,57 @@ class SheetBase:
     self.xFormula = SettingItemStr('xformula', 'X', 'A', self.validate)
     self.yFormula = SettingItemStr('yformula', 'Y', 'B', self.validate)
     self.xRange = SettingItemRange('xrange', 'X range', '-inf:inf')
+    self.errors_ = None
 
-    from functions import getTableColumnLabel
-    self.errors = ['sqrt(%s)' % getTableColumnLabel(c) for c in range(self.colCount())]
-
-    self.columncache = {}
     self.formulacache = {}
     self.formulaerrcache = {}
     self.evalcache = {}
     self.evalerrcache = {}
 
+    # cell data is loaded on demand by getColumns
+    self.columns_ = None
+
   def validate(self, formula):
     self.parseFormula(formula)
     return QValidator.Acceptable, 'OK'
 
+  @classmethod
+  def toColumns(cls, rows, ncols):
+    # rows: list of lists of cell values
+    try:
+      columns = np.array(rows, dtype=float).reshape(len(rows), ncols).T
+    except (ValueError, TypeError):
+      columns = np.full((ncols, len(rows)), np.nan)
+      for r, row in enumerate(rows):
+        for c, v in enumerate(row):
+          try:
+            columns[c,r] = float(v)
+          except (ValueError, TypeError):
+            pass
+    return np.ascontiguousarray(columns)
+
+  def createColumns(self):
+    return self.toColumns(
+      [[self.getValue(r, c) for c in range(self.colCount())] for r in range(self.rowCount())],
+      self.colCount())
+
+  def getColumns(self):
+    # float64 array of (column, row); non-numeric cells are NaN
+    if self.columns_ is None:
+      self.columns_ = self.createColumns()
+    return self.columns_
+
+  def isLoaded(self):
+    return self.columns_ is not None
+
+  def free(self):
+    # drops the cell data; it is loaded again when needed
+    self.columns_ = None
+    self.evalcache.clear()
+    self.evalerrcache.clear()
+
   def getColumnValuesF(self, c):
-    if c not in self.columncache:
-      values = []
-      for r in range(self.rowCount()):
-        v = self.getValue(r, c)
-        try:
-          v = float(v)
-        except:
-          v = np.nan
-        values.append(v)
-      self.columncache[c] = np.array(values)
-    return self.columncache[c]
+    return self.getColumns()[c]
 
   def colCount(self):
     raise NotImplementedError()
@@ -60,8 +85,9 @@ class SheetBase:
     raise NotImplementedError()
 
   def xValues(self):
-    cols = self.evalFormula(self.xFormula.value())
-    return np.array([[(v if self.xRange.inRange(v) else None) for v in vals] for vals in cols])
+    v1, v2 = self.xRange.value()
+    cols = [np.asarray(vals, dtype=float) for vals in self.evalFormula(self.xFormula.value())]
+    return np.array([np.where((v1 <= x) & (x <= v2), x, np.nan) for x in cols])
 
   def yValues(self):
     return self.evalFormula(self.yFormula.value())
@@ -69,10 +95,22 @@ class SheetBase:
   def yErrors(self):
     return self.evalFormulaError(self.yFormula.value())
 
+  def getErrors(self):
+    # errors_ stays None while the default errors are used
+    if self.errors_ is None:
+      from functions import getTableColumnLabel
+      return ['sqrt(%s)' % getTableColumnLabel(c) for c in range(self.colCount())]
+    return self.errors_
+
+  def setErrors(self, errors):
+    self.errors_ = list(errors)
+    self.formulaerrcache.clear()
+    self.evalerrcache.clear()
+
   def setError(self, col, formula):
-    self.errors[col] = formula
-    self.formulacache.clear()
-    self.evalcache.clear()
+    errors = list(self.getErrors())
+    errors[col] = formula
+    self.setErrors(errors)
 
   def freeFunctions(self, expr):
     from sympy.core.function import UndefinedFunction
@@ -137,7 +175,7 @@ class SheetBase:
     ret = []
 
     for f, expr, args, args_c in exprs:
-      errs = [self.parseFormula(self.errors[c])[0] for c in args_c]
+      errs = [self.parseFormula(self.getErrors()[c])[0] for c in args_c]
       errexprs = [e for f, e, a, c in errs]
 
       expr_ = sympy.sqrt(sum([expr.diff(a)**2*(e**2) for a, e in zip(args, errexprs)]))
@@ -1,15 +1,51 @@
 import logging
-from PyQt5.QtCore import pyqtSignal, QPoint
+from PyQt5.QtCore import Qt, pyqtSignal, QPoint, QAbstractTableModel
 from PyQt5.QtGui import QValidator
 from PyQt5.QtWidgets import \
-  QWidget, QTableWidgetItem, QGridLayout, QLabel, \
-  QPushButton, QMenu
+  QWidget, QGridLayout, QLabel, QPushButton, QMenu
 
 import log
 from commonwidgets import *
 from functions import getTableColumnLabel
 
 
+class SheetModel(QAbstractTableModel):
+  # read-only view of the cells of a sheet
+  def __init__(self, sheet):
+    super().__init__()
+    self.sheet = sheet
+
+  def rowCount(self, parent=None):
+    return self.sheet.rowCount()
+
+  def columnCount(self, parent=None):
+    return self.sheet.colCount()
+
+  def data(self, index, role=Qt.DisplayRole):
+    if role == Qt.DisplayRole and index.isValid():
+      return self.formatValue(self.sheet.getValue(index.row(), index.column()))
+    return None
+
+  @classmethod
+  def formatValue(cls, value):
+    # numeric cells are floats; whole numbers are shown as integers, as
+    # they are written in the source files
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+      return str(int(value))
+    return str(value)
+
+  def headerData(self, section, orientation, role=Qt.DisplayRole):
+    if role != Qt.DisplayRole:
+      return None
+    if orientation == Qt.Horizontal:
+      return getTableColumnLabel(section)
+    return str(section + 1)
+
+  def flags(self, index):
+    return Qt.ItemIsSelectable | Qt.ItemIsEnabled
+
+
+
 class SheetWidget(QWidget):
   copyInputRequested = pyqtSignal(str, bool)
 
@@ -28,6 +64,18 @@ class SheetWidget(QWidget):
       'Copy to ALL sheets',
       lambda: self.copyInputRequested.emit(self.inputMenu.target, True))
 
+    self.table = None
+
+  def showEvent(self, ev):
+    # the inputs validate the formulae against the cell data, so the
+    # widgets are created when the sheet is first shown
+    if self.table is None:
+      self.createWidgets()
+    super().showEvent(ev)
+
+  def createWidgets(self):
+    sheet = self.sheet
+    vbox = self.layout()
 
     grid = QGridLayout()
     grid.addWidget(QLabel('X'), 0, 0)
@@ -48,16 +96,9 @@ class SheetWidget(QWidget):
     vbox.addLayout(grid)
 
 
-    self.table = TableWidget()
-    self.table.setColumnCount(sheet.colCount())
-    self.table.setRowCount(sheet.rowCount())
+    self.table = TableView(SheetModel(sheet))
     vbox.addWidget(self.table)
 
-    for c in range(sheet.colCount()):
-      self.table.setHorizontalHeaderItem(c, QTableWidgetItem(getTableColumnLabel(c)))
-      for r in range(sheet.rowCount()):
-        self.table.setItem(r, c, QTableWidgetItem(str(self.sheet.getValue(r, c))))
-
   def showInputMenu(self, btn, target):
     self.inputMenu.target = target
     self.inputMenu.exec_(btn.mapToGlobal(QPoint(0, btn.rect().height())))
@@ -1,42 +1,29 @@
-import numpy as np
 from PyQt5.QtGui import QValidator
 
 from settingobj import SettingObj
 from settingitems import *
 from commonwidgets import *
+import smoothingcore
 
 
 
-__all__ = ['SmoothNop', 'SmoothSavGol']
+__all__ = ['SmoothNop', 'SmoothSavGol', 'smoothMethods']
 
 
 
-class SmoothBase(SettingObj):
-  def smooth(self, x, y):
-    raise NotImplementedError()
+class SmoothNop(SettingObj, smoothingcore.SmoothNop):
+  pass
 
 
 
-class SmoothNop(SmoothBase):
-  name  = 'nop'
-  label = 'Do nothing'
-
-  def smooth(self, x, y):
-    return y
-
-
-
-class SmoothSavGol(SmoothBase):
-  name  = 'savgol'
-  label = 'Savitzky-Golay'
-
+class SmoothSavGol(SettingObj, smoothingcore.SmoothSavGol):
   def __init__(self):
     super().__init__()
     self.addSettingItem(SettingItemInt(
-      'windowLength', 'Window length', 3,
+      'windowLength', 'Window length', self.settingDefaults['windowLength'],
       validator=self.validateWindowLength))
     self.addSettingItem(SettingItemInt(
-      'polyorder', 'Poly order', 2,
+      'polyorder', 'Poly order', self.settingDefaults['polyorder'],
       validator=self.validatePolyorder))
 
     self.windowLength.valueChanged.connect(
@@ -54,10 +41,6 @@ class SmoothSavGol(SmoothBase):
       return QValidator.Invalid, 'Must be less than Window length'
     return QValidator.Acceptable, 'OK'
 
-  def smooth(self, x, y):
-    from scipy.signal import savgol_filter
-    return savgol_filter(y, self.windowLength.value(), self.polyorder.value())
-
   def descriptionWidget(self):
     w = DescriptionWidget()
     w.addTitle('Savitzky-Golay filter')
@@ -67,3 +50,7 @@ This uses <code>scipy.signal.savgol_filter()</code>.<br>
 <a href="{0}">{0}</a>
 '''.format(url).strip(), richtext=True)
     return w
+
+
+
+smoothMethods = [SmoothNop, SmoothSavGol]
@@ -0,0 +1,39 @@
+from functions import SettingValues
+
+
+
+__all__ = ['SmoothNop', 'SmoothSavGol', 'smoothMethods']
+
+
+
+class SmoothBase(SettingValues):
+  def smooth(self, x, y):
+    raise NotImplementedError()
+
+
+
+class SmoothNop(SmoothBase):
+  name  = 'nop'
+  label = 'Do nothing'
+
+  def smooth(self, x, y):
+    return y
+
+
+
+class SmoothSavGol(SmoothBase):
+  name  = 'savgol'
+  label = 'Savitzky-Golay'
+  settingDefaults = {
+    'windowLength': '3',
+    'polyorder': '2'
+  }
+
+  def smooth(self, x, y):
+    from scipy.signal import savgol_filter
+    return savgol_filter(
+      y, int(self.strValue('windowLength')), int(self.strValue('polyorder')))
+
+
+
+smoothMethods = [SmoothNop, SmoothSavGol]
@@ -0,0 +1,133 @@
+import logging
+
+from line import Line
+from toolbase import ToolBase
+
+
+
+__all__ = ['Node', 'SheetNode', 'LinesNode']
+
+
+
+class Node:
+  # A value of the recompute graph.  The value is computed only when the
+  # node is dirty; invalidating a node marks its dependents dirty too.
+  def __init__(self):
+    self.dirty = True
+    self.value_ = None
+    self.dependents = []
+
+  def addDependent(self, node):
+    if node not in self.dependents:
+      self.dependents.append(node)
+
+  def removeDependent(self, node):
+    if node in self.dependents:
+      self.dependents.remove(node)
+
+  def invalidate(self):
+    if self.dirty:
+      return
+    self.dirty = True
+    for node in self.dependents:
+      node.invalidate()
+
+  def value(self):
+    if self.dirty:
+      self.value_ = self.compute()
+      self.dirty = False
+    return self.value_
+
+  def compute(self):
+    raise NotImplementedError()
+
+
+
+class SheetNode(Node):
+  # [(name, x, y, y_)] of a sheet; recomputed when its formulae, X range
+  # or error formulae change.  version counts the computations.
+  def __init__(self, sheet):
+    super().__init__()
+    self.sheet = sheet
+    self.version = 0
+    self.signature_ = self.signature()
+    for item in self.settings():
+      item.valueChanged.connect(self.check)
+
+  def settings(self):
+    s = self.sheet
+    return s.xFormula, s.yFormula, s.xRange
+
+  def release(self):
+    # called when the sheet is removed
+    for item in self.settings():
+      item.valueChanged.disconnect(self.check)
+
+  def signature(self):
+    s = self.sheet
+    return s.xFormula.strValue(), s.yFormula.strValue(), s.xRange.strValue(), tuple(s.errors_ or ())
+
+  def check(self):
+    signature = self.signature()
+    if signature != self.signature_:
+      self.signature_ = signature
+      self.invalidate()
+
+  def free(self):
+    # drops the lines and the cell data of the sheet until it is needed
+    self.sheet.free()
+    self.value_ = None
+    self.dirty = True
+
+  def compute(self):
+    logging.debug('Evaluate sheet: %s' % self.sheet.name)
+    self.version += 1
+    X = self.sheet.xValues()
+    Y = self.sheet.yValues()
+    Y_ = self.sheet.yErrors()
+    if len(X) == 1: X = list(X) * len(Y)
+    if len(X) != len(Y): raise RuntimeError('X and Y formulae count mismatch')
+
+    ret = []
+    for i, (x, y, y_) in enumerate(zip(X, Y, Y_)):
+      name = self.sheet.name
+      if len(Y) > 1: name += ':%s' % i
+      ret.append((name,) + Line.cleanUp(x, y, y_))
+    return ret
+
+
+
+class LinesNode(Node):
+  # Lines of all enabled sheets with unique names.  Line objects of the
+  # sheets not computed again are reused, so that the tools can keep the
+  # data derived from them.
+  def __init__(self):
+    super().__init__()
+    self.sheets = []
+    self.cache = {}
+
+  def setSheets(self, sheets):
+    for node in sheets:
+      node.check()
+    if sheets != self.sheets:
+      for node in self.sheets:
+        node.removeDependent(self)
+      for node in sheets:
+        node.addDependent(self)
+      self.sheets = list(sheets)
+      self.dirty = True
+
+  def compute(self):
+    lines, cache, names = [], {}, {}
+    for node in self.sheets:
+      for name, x, y, y_ in node.value():
+        name = ToolBase.uniqueName(name, names)
+        names[name] = True
+        key = name, node, node.version
+        line = self.cache.get(key)
+        if line is None:
+          line = Line(name, x, y, y_)
+        cache[key] = line
+        lines.append(line)
+    self.cache = cache
+    return lines
@@ -16,53 +16,91 @@ class ToolBase(QObject, SettingObj):
     self.graphWidget = graphWidget
     self.lines = []
     self.lineNameMap = {}
+    self.sourceLines = []
+    self.curveItems = {}
 
   def clear(self):
     self.lines = []
     self.lineNameMap = {}
+    self.sourceLines = []
     self.cleared.emit()
 
-  def add(self, name, x, y, y_):
-    if name in self.lineNameMap:
+  @classmethod
+  def uniqueName(cls, name, names):
+    if name in names:
       i = 2
       while True:
         name2 = '%s_%d' % (name, i)
-        if name2 not in self.lineNameMap:
+        if name2 not in names:
           break
         i += 1
       name = name2
+    return name
 
+  def add(self, name, x, y, y_):
+    name = self.uniqueName(name, self.lineNameMap)
     x, y, y_ = Line.cleanUp(x, y, y_)
-    l = Line(name, x, y, y_)
-    self.lines.append(l)
-    self.lineNameMap[name] = l
-    self.added.emit(l)
-    return l
+    return self.addLine(Line(name, x, y, y_))
+
+  def addLine(self, line):
+    self.lines.append(line)
+    self.lineNameMap[line.name] = line
+    self.added.emit(line)
+    return line
+
+  def setLines(self, lines):
+    # lines: source lines with unique names.  The tool keeps its own copy
+    # of each line while the source line object stays the same; returns
+    # False if nothing changed.
+    if [src for src, line in self.sourceLines] == lines:
+      return False
+
+    prev = dict(self.sourceLines)
+    self.clear()
+    for src in lines:
+      line = prev.get(src)
+      if line is None:
+        line = Line(src.name, src.x, src.y, src.y_)
+      self.sourceLines.append((src, self.addLine(line)))
+    return True
 
   def getLines(self):
     return self.lines
 
   def getGraphItems(self, colorpicker):
-    items = []
+    # curves are reused by the line name, which is unique in the tool;
+    # only their data and color change
+    items, curveItems = [], {}
     for line in self.getLines():
+      assert line.name not in curveItems, 'duplicate line name: %s' % line.name
       col = colorpicker.next()
-      curve = PlotCurveItem(line.x, line.y, self.graphWidget, col, line.name)
+      curve = self.curveItems.pop(line.name, None)
+      if curve is None:
+        curve = PlotCurveItem(line.x, line.y, self.graphWidget, col, line.name)
+      else:
+        if curve.x is not line.x or curve.y is not line.y:
+          curve.setXY(line.x, line.y)
+        curve.setPenColor(col)
+      curveItems[line.name] = curve
       items.append(curve)
       # if line.plotErrors:
       #   items.append(pg.ErrorBarItem(
       #     x=line.x, y=line.y, height=line.y_*2, beam=0.2, pen=pen))
       #   items.append(pg.ScatterPlotItem(
       #     x=line.x, y=line.y, brush=pg.mkBrush(color=col)))
+    self.curveItems = curveItems
     return items
 
   def getXrange(self):
-    if len(self.lines) == 0: return 0, 1
-    l1, l2 = zip(*[l.getXrange() for l in self.lines])
+    ranges = [r for r in (l.getXrange() for l in self.lines) if r]
+    if len(ranges) == 0: return 0, 1
+    l1, l2 = zip(*ranges)
     return min(l1), max(l2)
 
   def getYrange(self):
-    if len(self.lines) == 0: return 0, 1
-    l1, l2 = zip(*[l.getYrange() for l in self.lines])
+    ranges = [r for r in (l.getYrange() for l in self.lines) if r]
+    if len(ranges) == 0: return 0, 1
+    l1, l2 = zip(*ranges)
     return min(l1), max(l2)
 
   def newSession(self):
@@ -158,18 +158,15 @@ class MethodSelectorBase(QWidget):
 
 class MethodSelectorSmooth(MethodSelectorBase):
   def __init__(self):
-    super().__init__('smooth', 'Smoothing', [SmoothNop(), SmoothSavGol()])
+    super().__init__('smooth', 'Smoothing', [cls() for cls in smoothMethods])
 
 class MethodSelectorBGSub(MethodSelectorBase):
   def __init__(self):
-    super().__init__('bgsub', 'BG subtraction', [
-      BGSubNop(), BGSubMinimum(), BGSubLeftEdge(), BGSubRightEdge()])
+    super().__init__('bgsub', 'BG subtraction', [cls() for cls in bgsubMethods])
 
 class MethodSelectorInterp(MethodSelectorBase):
   def __init__(self, dx):
-    super().__init__('interp', 'Interpolation', [
-      InterpCubicSpline(), InterpBSpline(), InterpLinear(), InterpPchip(),
-      InterpAkima(), InterpKrogh(), InterpBarycentric()])
+    super().__init__('interp', 'Interpolation', [cls() for cls in interpMethods])
 
     self.comboHBox.addWidget(QLabel('dx'))
     self.comboHBox.addWidget(dx.getWidget())
@@ -19,6 +19,9 @@ class Tsuna(QApplication):
 
 
 if __name__ == '__main__':
+  import multiprocessing
+  multiprocessing.freeze_support()
+
   import logging, log
   logging.basicConfig(level=logging.DEBUG)
   log.setup()
@@ -0,0 +1,60 @@
+import sys, os
+import argparse
+import logging
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description='Evaluate the IAD and fit tools of Tsuna session files without GUI.')
+  parser.add_argument('sessions', nargs='+', help='session files (.json, .msgpack)')
+  parser.add_argument('-o', '--outdir', default='.', help='output directory')
+  parser.add_argument('--iad', action='store_true', help='evaluate IAD only')
+  parser.add_argument('--fit', action='store_true', help='fit only')
+  parser.add_argument('--method', default='Nelder-Mead', help='optimize method')
+  parser.add_argument('--params', help='fitted parameters, e.g. "F1_x0,F1_a" (default: all)')
+  parser.add_argument('--format', default='json', help='comma separated list of json, csv and xlsx')
+  parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes')
+  parser.add_argument('-v', '--verbose', action='store_true')
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+  from batch import processSession
+  iad, fit = args.iad or not args.fit, args.fit or not args.iad
+  params = args.params.split(',') if args.params else None
+  formats = [f.strip() for f in args.format.split(',') if f.strip()]
+  taskArgs = args.outdir, formats, iad, fit, args.method, params
+
+  failed = 0
+  if args.jobs > 1 and len(args.sessions) > 1:
+    from fitobjective import processPool
+    with processPool(args.jobs) as executor:
+      futures = [(fn, executor.submit(processSession, fn, *taskArgs)) for fn in args.sessions]
+      results = []
+      for fn, fut in futures:
+        try:
+          results.append((fn, fut.result(), None))
+        except Exception as ex:
+          results.append((fn, None, ex))
+  else:
+    results = []
+    for fn in args.sessions:
+      try:
+        results.append((fn, processSession(fn, *taskArgs), None))
+      except Exception as ex:
+        results.append((fn, None, ex))
+
+  for fn, written, ex in results:
+    if ex is None:
+      logging.info('%s: %s' % (fn, ', '.join(written)))
+    else:
+      logging.error('%s: %s' % (fn, ex))
+      failed += 1
+
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  import multiprocessing
+  multiprocessing.freeze_support()
+  sys.exit(main())
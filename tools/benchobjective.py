@@ -0,0 +1,122 @@
+import sys, os
+import time
+import numpy as np
+
+
+rootdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+srcdir = os.path.join(rootdir, 'src')
+sys.path.insert(0, srcdir)
+
+from fitobjective import FitProblem, FitObjective
+
+
+# Compares objective evaluations per second of the compiled objective
+# against the previous implementation (one lambdified function per peak,
+# constraints evaluated by sympy subs() on every call).
+#
+#   python tools/benchobjective.py [number of peaks] [number of constraints]
+
+
+expr = 'a*exp(-(x-b)**2/(2*c**2))'
+
+
+def createProblem(npeaks, nconstraints):
+  x = np.linspace(0, 100, 2000)
+  y = np.zeros(len(x))
+  fixed = {}
+  variables = []
+  for i in range(npeaks):
+    a, b, c = 1 + i%3, 100*(i + .5)/npeaks, 2
+    y += a*np.exp(-(x-b)**2/(2*c**2))
+    for n, v in ('a', a*1.1), ('b', b+.5), ('c', c*.9):
+      name = FitProblem.symbolName(i, n)
+      fixed[name] = v
+      variables.append(name)
+
+  constraints = []
+  for i in range(min(nconstraints, npeaks - 1)):
+    lhs = FitProblem.symbolName(i + 1, 'c')
+    constraints.append((lhs, '%s*1.0' % FitProblem.symbolName(i, 'c')))
+    variables.remove(lhs)
+
+  return FitProblem([expr]*npeaks, variables, constraints, fixed, x, y)
+
+
+def legacyObjective(problem):
+  from sympy import Symbol, sympify, lambdify
+
+  constraints = []
+  for lhs, rhs in problem.constraints:
+    rhs = sympify(rhs)
+    params, subs = [], []
+    for sym in rhs.free_symbols:
+      if sym.name in problem.variables:
+        params.append((sym.name, problem.variables.index(sym.name)))
+      else:
+        subs.append((sym, problem.fixed[sym.name]))
+    constraints.append((lhs, rhs.subs(subs), params))
+
+  def calcConstraintValues(pvalues):
+    pairs = []
+    for lhs, rhs, subs in constraints:
+      v = rhs.subs([(n, pvalues[i]) for n, i in subs])
+      pairs.append((lhs, float(v)))
+    return pairs
+
+  funcs = []
+  for i, e in enumerate(problem.exprs):
+    names = [FitProblem.symbolName(i, n) for n in 'abc']
+    uparams = [n for n in names if n in problem.variables]
+    cparams = [lhs for lhs, rhs, subs in constraints if lhs in names]
+    fixed = [n for n in names if n not in uparams + cparams]
+    args = [Symbol('x')] + [Symbol(n.split('_', 1)[1]) for n in uparams + cparams + fixed]
+    func = lambdify(args, sympify(e), 'numpy')
+    fixedv = [problem.fixed[n] for n in fixed]
+    pindices = [problem.variables.index(n) for n in uparams]
+    cindices = [j for j, (l, r, s) in enumerate(constraints) if l in cparams]
+    funcs.append((lambda func, fixedv, pindices, cindices: (
+      lambda x, values, cvalues: func(
+        x, *([values[j] for j in pindices] + [cvalues[j] for j in cindices] + fixedv))
+    ))(func, fixedv, pindices, cindices))
+
+  x, y = problem.x, problem.y
+  def R2(a):
+    cvals = [v for p, v in calcConstraintValues(a)]
+    return np.sum((np.sum([f(x, a, cvals) for f in funcs], axis=0) - y)**2)
+  return R2
+
+
+def evalsPerSecond(func, a0, duration=2):
+  rnd = np.random.RandomState(0)
+  cnt = 0
+  t0 = time.time()
+  while time.time() - t0 < duration:
+    func(a0 * (1 + rnd.normal(0, 1e-3, len(a0))))
+    cnt += 1
+  return cnt/(time.time() - t0)
+
+
+def main():
+  npeaks = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  nconstraints = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+  problem = createProblem(npeaks, nconstraints)
+  a0 = np.array([problem.fixed[n] for n in problem.variables])
+
+  print('%d peaks, %d variables, %d constraints, %d points' % (
+    npeaks, len(problem.variables), len(problem.constraints), len(problem.x)))
+
+  results = []
+  for label, create in ('legacy', legacyObjective), ('compiled', lambda p: FitObjective(p).R2):
+    t0 = time.time()
+    func = create(problem)
+    tprep = time.time() - t0
+    eps = evalsPerSecond(func, a0)
+    results.append((label, func(a0), eps))
+    print('%-10s prepare %8.1f ms  %10.1f evals/s' % (label, tprep*1e3, eps))
+
+  (l1, v1, e1), (l2, v2, e2) = results
+  print('speedup: x%.1f (R2 %.6g vs %.6g)' % (e2/e1, v1, v2))
+
+
+if __name__ == '__main__':
+  main()